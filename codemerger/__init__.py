@@ -0,0 +1,16 @@
+from .budget import export_budgeted, pack
+from .cache import ScanCache
+from .config import CONFIG_FILE, load_config, save_config
+from .exporters import export_file, export_json, export_markdown, write_json, write_jsonl, write_markdown
+from .packfile import PackReader
+from .records import STATUSES, FileRecord, RecordStore
+from .scanner import Scanner
+
+__all__ = [
+    'export_budgeted', 'pack',
+    'ScanCache',
+    'CONFIG_FILE', 'load_config', 'save_config',
+    'export_file', 'export_json', 'export_markdown', 'write_json', 'write_jsonl', 'write_markdown',
+    'PackReader',
+    'STATUSES', 'FileRecord', 'RecordStore', 'Scanner',
+]
@@ -0,0 +1,313 @@
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from binaryornot.helpers import is_binary_string
+
+from .config import BINARY_EXTENSIONS
+from .encoding import EncodingDetector
+from .exporters import export_file
+from .ignore import IgnoreMatcher
+from .processor import HEAD_SIZE, content_hash
+from .scanner import Scanner
+from .search import search_content
+from .walker import ParallelWalker
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+RESULT_FORMAT = 1
+# Описание дерева лежит в его корне: совпадающее дерево не генерируется заново
+MANIFEST_NAME = '.codemerger-bench.json'
+IGNORED_DIR = 'node_modules'
+TEXT_EXTENSIONS = ('.py', '.js', '.ts', '.md', '.txt', '.json', '.c', '.h')
+LEGACY_ENCODINGS = ('cp1251', 'latin-1', 'shift_jis')
+EXPORT_FORMATS = ('md', 'json', 'jsonl')
+# Частое слово, редкое слово и регулярное выражение
+SEARCH_QUERIES = (('return', False), ('zebra_unique', False), (r'def \w+_\d+\(', True))
+# Отклонение по времени стадии, которое считается регрессией
+REGRESSION_THRESHOLD = 0.10
+MAX_FILE_SIZE = 4 * 1024 * 1024
+MB = 1024 * 1024
+
+CODE_LINES = (
+    "def handler_{n}(request, *args):",
+    "    return process(request, limit={n})",
+    "class Model{n}(Base):",
+    "    value = compute({n}) + offset",
+    "import module_{n}",
+    "# TODO: refactor block {n}",
+    "for item in items_{n}:",
+    "        result.append(item * {n})",
+    "if value_{n} is None:",
+    "    raise ValueError('bad value {n}')",
+)
+LEGACY_TEXT = {
+    'cp1251': "Пример текста в старой кодировке, строка {n}",
+    'latin-1': "Élément numéro {n}, façade déjà prête",
+    'shift_jis': "テキストの例、行 {n}",
+}
+
+
+def default_spec():
+    return {
+        'files': 5000,
+        'depth': 4,
+        'fanout': 4,
+        'median_size': 4096,
+        'binary_ratio': 0.1,
+        'legacy_ratio': 0.05,
+        'ignored_files': 1000,
+        'seed': 1
+    }
+
+
+def text_pool(rng, template_lines, size):
+    # Один большой кусок текста, из которого файлы нарезаются срезами
+    lines = []
+    total = 0
+    while total < size:
+        line = rng.choice(template_lines).format(n=rng.randrange(100000))
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines)
+
+
+def file_size(rng, spec):
+    return min(int(rng.lognormvariate(0, 1.0) * spec['median_size']) + 1, MAX_FILE_SIZE)
+
+
+def make_dirs(root, spec):
+    dirs = ['']
+    level = ['']
+    for depth in range(spec['depth']):
+        next_level = []
+        for parent in level:
+            for i in range(spec['fanout']):
+                next_level.append(os.path.join(parent, f"d{depth}_{i}"))
+        dirs.extend(next_level)
+        level = next_level
+    for rel_dir in dirs:
+        os.makedirs(os.path.join(root, rel_dir), exist_ok=True)
+    return dirs
+
+
+def generate_tree(root, spec=None):
+    spec = dict(default_spec(), **(spec or {}))
+    manifest_path = os.path.join(root, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == spec:
+                return spec
+    except FileNotFoundError:
+        # Без описания папка не наша: удалять её нельзя, заполнять чужие файлы тоже
+        if os.path.isdir(root) and os.listdir(root):
+            raise FileExistsError(f"{root} is not empty and has no {MANIFEST_NAME}, refusing to replace it") from None
+    except (OSError, ValueError):
+        pass
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    rng = random.Random(spec['seed'])
+    dirs = make_dirs(root, spec)
+    pool = text_pool(rng, CODE_LINES, 2 * MAX_FILE_SIZE)
+    legacy_pools = {encoding: text_pool(rng, (line,), 256 * 1024).encode(encoding)
+                    for encoding, line in LEGACY_TEXT.items()}
+
+    def write(rel_path, data):
+        with open(os.path.join(root, rel_path), 'wb') as f:
+            f.write(data)
+
+    for n in range(spec['files']):
+        rel_dir = rng.choice(dirs)
+        size = file_size(rng, spec)
+        kind = rng.random()
+        if kind < spec['binary_ratio']:
+            # Половина двоичных файлов узнаётся по расширению, половина - по содержимому
+            ext = '.png' if n % 2 else '.dat'
+            data = b'\0' + rng.randbytes(size - 1) if size > 1 else b'\0'
+        elif kind < spec['binary_ratio'] + spec['legacy_ratio']:
+            ext = '.txt'
+            encoded = legacy_pools[LEGACY_ENCODINGS[n % len(LEGACY_ENCODINGS)]]
+            data = encoded[:min(size, len(encoded))]
+        else:
+            ext = rng.choice(TEXT_EXTENSIONS)
+            start = rng.randrange(len(pool) - size)
+            data = pool[start:start + size].encode('ascii')
+        write(os.path.join(rel_dir, f"f{n}{ext}"), data)
+
+    ignored_dir = os.path.join(root, IGNORED_DIR, 'pkg')
+    os.makedirs(ignored_dir, exist_ok=True)
+    for n in range(spec['ignored_files']):
+        size = file_size(rng, spec)
+        start = rng.randrange(len(pool) - size)
+        write(os.path.join(IGNORED_DIR, 'pkg', f"m{n}.js"), pool[start:start + size].encode('ascii'))
+    write('.gitignore', f"{IGNORED_DIR}/\n{MANIFEST_NAME}\n".encode('ascii'))
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(spec, f)
+    return spec
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS - байты
+    return round(peak / (MB if platform.system() == 'Darwin' else 1024), 1)
+
+
+def run_stage(fn, repeat):
+    # Лучшее из нескольких повторов: первый прогон прогревает кеш страниц
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    files, size = result[:2]
+    return {
+        'seconds': round(best, 4),
+        'files': files,
+        'bytes': size,
+        'files_per_s': round(files / best, 1) if best else None,
+        'mb_per_s': round(size / MB / best, 2) if best and size is not None else None,
+        # ru_maxrss только растёт: это пик процесса за эту и все предыдущие стадии, а не память самой стадии
+        'peak_rss_so_far_mb': peak_rss_mb()
+    }, result
+
+
+def stage_walk(root, threads):
+    entries = [entry for entry in ParallelWalker(IgnoreMatcher(root), threads) if entry[3] is not None]
+    return len(entries), None, entries
+
+
+def stage_classify(entries):
+    text = []
+    read = 0
+    for root, rel_root, name, st, error in entries:
+        if os.path.splitext(name)[1].lower() in BINARY_EXTENSIONS:
+            continue
+        with open(os.path.join(root, name), 'rb') as f:
+            head = f.read(HEAD_SIZE)
+        read += len(head)
+        if not is_binary_string(head):
+            text.append((root, rel_root, name))
+    return len(entries), read, text
+
+
+def stage_decode(text):
+    detector = EncodingDetector()
+    read = 0
+    for root, rel_root, name in text:
+        with open(os.path.join(root, name), 'rb') as f:
+            raw_data = f.read()
+        read += len(raw_data)
+        detector.decode(raw_data, os.path.join(rel_root, name))
+        content_hash(raw_data)
+    return len(text), read
+
+
+def stage_scan(root, executor, workers, threads):
+    # С индексом содержимого, как в конфигурации по умолчанию
+    scanner = Scanner(executor=executor, workers=workers, walker_threads=threads, content_index=True)
+    processed, errors = scanner.scan(root)
+    return processed, scanner.progress.bytes_read, scanner.structure
+
+
+def stage_export(structure, root, fmt, out_dir):
+    path = os.path.join(out_dir, f"export.{fmt}")
+    export_file(structure, root, path, fmt)
+    size = os.path.getsize(path)
+    os.remove(path)
+    return len(structure), size
+
+
+def stage_search(structure, indexed=True):
+    records = structure.by_status['OK']
+    size = sum(len(structure.content(record)) for record in records)
+    index = structure.index
+    if not indexed:
+        # Без индекса search_content перебирает все файлы
+        structure.index = None
+    try:
+        for query, regex in SEARCH_QUERIES:
+            search_content(structure, query, regex=regex)
+    finally:
+        structure.index = index
+    return len(records) * len(SEARCH_QUERIES), size * len(SEARCH_QUERIES)
+
+
+def run_benchmark(root=None, spec=None, repeat=3, executor='thread', workers=None, threads=None, log=None):
+    # root=None - дерево во временной папке, удаляется после замеров
+    temp_dir = tempfile.mkdtemp(prefix='codemerger-bench-')
+    tree = root or os.path.join(temp_dir, 'tree')
+    try:
+        started = time.perf_counter()
+        spec = generate_tree(tree, spec)
+        if log:
+            log(f"Tree ready in {time.perf_counter() - started:.1f}s: {tree}")
+        stages = {}
+
+        def measure(name, fn):
+            stages[name], result = run_stage(fn, repeat)
+            if log:
+                stage = stages[name]
+                mb_note = f"{stage['mb_per_s']:9.1f} MB/s" if stage['mb_per_s'] is not None else ""
+                log(f"{name:14} {stage['seconds']:9.3f}s {stage['files_per_s'] or 0:12.0f} files/s {mb_note}")
+            return result
+
+        entries = measure('walk', lambda: stage_walk(tree, threads))[2]
+        text = measure('classify', lambda: stage_classify(entries))[2]
+        measure('decode', lambda: stage_decode(text))
+        structure = measure('scan', lambda: stage_scan(tree, executor, workers, threads))[2]
+        for fmt in EXPORT_FORMATS:
+            measure(f'export_{fmt}', lambda: stage_export(structure, tree, fmt, temp_dir))
+        measure('search', lambda: stage_search(structure))
+        measure('search_linear', lambda: stage_search(structure, indexed=False))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return {
+        'format': RESULT_FORMAT,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'executor': executor,
+        'repeat': repeat,
+        'tree': spec,
+        'stages': stages,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def compare(result, baseline, threshold=REGRESSION_THRESHOLD):
+    # Строки (стадия, время в базе, текущее время, относительное изменение) и список регрессий
+    rows = []
+    regressions = []
+    for name, stage in result['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if not base or not base.get('seconds'):
+            rows.append((name, None, stage['seconds'], None))
+            continue
+        change = stage['seconds'] / base['seconds'] - 1
+        rows.append((name, base['seconds'], stage['seconds'], change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def load_result(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_result(result, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
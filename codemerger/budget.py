@@ -0,0 +1,216 @@
+import fnmatch
+import io
+import json
+import os
+import re
+
+from .exporters import BINARY_FORMATS, COMPRESSION_SUFFIXES, WRITERS, dump_json, export_file, json_record, write_markdown_file
+from .packfile import load_msgpack
+from .processor import TRUNCATED_MARKER
+from .records import STATUSES
+
+# Грубая оценка: в исходном коде токен в среднем занимает около четырёх байт
+BYTES_PER_TOKEN = 4
+TOKENIZERS = ('bytes', 'tiktoken')
+
+
+def byte_tokens(text):
+    size = len(text) if text.isascii() else len(text.encode('utf-8', 'replace'))
+    return (size + BYTES_PER_TOKEN - 1) // BYTES_PER_TOKEN
+
+
+def get_tokenizer(name='bytes'):
+    # 'tiktoken' или 'tiktoken:<кодировка>'; без установленного tiktoken остаётся оценка по байтам
+    if callable(name):
+        return name
+    if not name or name == 'bytes':
+        return byte_tokens
+    kind, _, encoding_name = name.partition(':')
+    if kind != 'tiktoken':
+        raise ValueError(f"Unknown tokenizer: {name}")
+    try:
+        import tiktoken
+    except ImportError:
+        return byte_tokens
+    encoding = tiktoken.get_encoding(encoding_name or 'cl100k_base')
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+class ExportPart:
+    # Подмножество RecordStore с тем же интерфейсом, который нужен writer'ам экспорта
+    def __init__(self, structure):
+        self.structure = structure
+        self.root = structure.root
+        self.folders = {}
+        self.contents = {}
+        self.tokens = 0
+        # Счётчики статусов ведутся при добавлении, а не отдельным проходом
+        self.status_counts = {status: 0 for status in STATUSES}
+
+    def __len__(self):
+        return sum(self.status_counts.values())
+
+    def __iter__(self):
+        for files in self.folders.values():
+            yield from files
+
+    def __bool__(self):
+        return bool(self.folders)
+
+    def items(self):
+        return self.folders.items()
+
+    def values(self):
+        return self.folders.values()
+
+    def add(self, record, tokens, content=None):
+        self.folders.setdefault(record.folder, []).append(record)
+        self.status_counts[record.status] = self.status_counts.get(record.status, 0) + 1
+        if content is not None:
+            self.contents[record] = content
+        self.tokens += tokens
+
+    def counts(self):
+        return dict(self.status_counts)
+
+    def rel_path(self, record):
+        return self.structure.rel_path(record)
+
+    def path(self, record):
+        return self.structure.path(record)
+
+    def content(self, record):
+        content = self.contents.get(record)
+        return content if content is not None else self.structure.content(record)
+
+
+def compile_priority(patterns):
+    return [re.compile(fnmatch.translate(pattern)) for pattern in patterns]
+
+
+def priority_key(structure, record, priority):
+    # Сначала файлы по порядку шаблонов приоритета, затем более свежие, затем более мелкие
+    rank = len(priority)
+    if priority:
+        rel_path = structure.rel_path(record)
+        for i, regex in enumerate(priority):
+            if regex.match(rel_path) or regex.match(record.name):
+                rank = i
+                break
+    return rank, -(record.mtime or 0), record.size
+
+
+def header_tokens(structure, folder_path, fmt, count):
+    # Заголовок, сводка и метаданные повторяются в каждой части: их цена измеряется на пустой части.
+    # Счётчики берутся от всей структуры - в части числа не длиннее
+    part = ExportPart(structure)
+    part.status_counts = structure.counts()
+    out = io.BytesIO() if fmt in BINARY_FORMATS else io.StringIO()
+    WRITERS[fmt](part, folder_path, out)
+    header = out.getvalue()
+    return count(header.decode('utf-8', 'replace') if isinstance(header, bytes) else header)
+
+
+def folder_text(folder, fmt):
+    # Что writer добавляет в часть за каждую папку, кроме записей её файлов
+    if fmt == 'md':
+        return f"### {folder if folder else 'Root'}\n"
+    if fmt == 'json':
+        # Разделитель, ключ, скобки и перевод строки перед закрывающей скобкой structure
+        return f",\n    {json.dumps(folder, ensure_ascii=False)}: [\n    ]\n  "
+    return ''
+
+
+def record_text(part, record, fmt):
+    # Запись о файле ровно в том виде, в котором её напишет writer формата: с экранированием и ключами
+    if fmt == 'md':
+        out = io.StringIO()
+        write_markdown_file(part, record, out.write)
+        return out.getvalue()
+    data = json_record(part, record)
+    if fmt == 'json':
+        return ',\n      ' + dump_json(data, 3)
+    if fmt == 'msgpack':
+        # Плюс строка индекса: путь и [смещение, длина]
+        msgpack = load_msgpack()
+        packed = msgpack.packb(data, use_bin_type=True) + msgpack.packb([data['path'], [2 ** 32, 2 ** 32]])
+        return packed.decode('utf-8', 'replace')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def pack(structure, budget, max_parts=1, tokenizer='bytes', priority_patterns=(), fmt='md', folder_path=None):
+    count = get_tokenizer(tokenizer)
+    priority = compile_priority(priority_patterns)
+    records = sorted(structure, key=lambda record: priority_key(structure, record, priority))
+    budget -= header_tokens(structure, folder_path or structure.root, fmt, count)
+    # Через эту часть записи отрисовываются с подменённым (обрезанным) содержимым
+    scratch = ExportPart(structure)
+
+    def tokens(record, content=None):
+        if content is None:
+            scratch.contents.pop(record, None)
+        else:
+            scratch.contents[record] = content
+        return count(record_text(scratch, record, fmt))
+
+    parts = []
+    dropped = []
+    for record in records:
+        cost = tokens(record)
+        folder_cost = count(folder_text(record.folder, fmt))
+
+        def fits(part):
+            return part.tokens + cost + (0 if record.folder in part.folders else folder_cost) <= budget
+
+        # Файл кладётся в первую часть, где хватает места, иначе открывается новая
+        part = next((p for p in parts if fits(p)), None)
+        if part is None:
+            if len(parts) >= max_parts:
+                dropped.append(record)
+                continue
+            part = ExportPart(structure)
+            parts.append(part)
+        if record.folder not in part.folders:
+            part.tokens += folder_cost
+        room = budget - part.tokens
+        if cost <= room:
+            part.add(record, cost)
+            continue
+        # Файл больше всего бюджета: в пустую часть идёт его начало, укорачиваемое, пока запись не влезет
+        empty = tokens(record, "")
+        content = structure.content(record) or ""
+        length = len(content)
+        truncated = ""
+        while length > 0 and cost > room:
+            length = length * max(room - empty, 0) // max(cost - empty, 1)
+            truncated = content[:length] + TRUNCATED_MARKER if length else ""
+            cost = tokens(record, truncated)
+        if cost > room:
+            truncated = ""
+            cost = empty
+        part.add(record, cost, content=truncated)
+    scratch.contents.clear()
+    if not parts:
+        parts.append(ExportPart(structure))
+    return parts, dropped
+
+
+def part_path(file_path, index, total):
+    if total == 1:
+        return file_path
+    root, ext = os.path.splitext(file_path)
+    if ext.lower() in COMPRESSION_SUFFIXES:
+        root, inner_ext = os.path.splitext(root)
+        ext = inner_ext + ext
+    return f"{root}.part{index}{ext}"
+
+
+def export_budgeted(structure, folder_path, file_path, fmt, budget, max_parts=1, tokenizer='bytes',
+                    priority_patterns=(), dedupe=True, compression=None):
+    parts, dropped = pack(structure, budget, max_parts, tokenizer, priority_patterns, fmt, folder_path)
+    paths = []
+    for i, part in enumerate(parts, 1):
+        path = part_path(file_path, i, len(parts))
+        export_file(part, folder_path, path, fmt, dedupe, compression)
+        paths.append(path)
+    return paths, dropped
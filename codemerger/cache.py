@@ -0,0 +1,128 @@
+import json
+import os
+import sqlite3
+import time
+
+CACHE_FILE = 'codemerger_cache.sqlite'
+# Файл базы и служебные файлы SQLite рядом с ним
+CACHE_FILE_SUFFIXES = ('', '-journal', '-wal', '-shm')
+MAX_CACHE_SIZE = 512 * 1024 * 1024
+# Ошибки не кешируем: они часто временные (файл заблокирован, занят и т.п.)
+CACHEABLE_STATUSES = ('OK', 'BINARY', 'SKIPPED')
+# Меняется вместе с таблицей files; старая таблица при открытии пересоздаётся
+SCHEMA_VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    encoding TEXT,
+    content TEXT,
+    digest INTEGER,
+    scanned_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_root ON files (root);
+'''
+
+
+def cache_path_for(config_path):
+    return os.path.join(os.path.dirname(os.path.abspath(config_path)), CACHE_FILE)
+
+
+class ScanCache:
+    def __init__(self, path=CACHE_FILE, max_size=MAX_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.conn = None
+        self.hits = 0
+        self.misses = 0
+
+    def files(self):
+        # Кеш может лежать внутри сканируемой папки, и тогда сканер его пропускает
+        path = os.path.abspath(self.path)
+        return [path + suffix for suffix in CACHE_FILE_SUFFIXES]
+
+    def open(self, settings):
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(SCHEMA)
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        if row is None or row[0] != str(SCHEMA_VERSION):
+            self.conn.execute('DROP TABLE files')
+            self.conn.executescript(SCHEMA)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+            self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+        # Содержимое зависит от настроек обрезки, поэтому при их смене кеш сбрасывается
+        settings_key = json.dumps(settings, sort_keys=True)
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+        if row is None or row[0] != settings_key:
+            self.conn.execute('DELETE FROM files')
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('settings', ?)", (settings_key,))
+            self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def lookup(self, file_path, st):
+        row = self.conn.execute(
+            'SELECT size, mtime_ns, inode, status, encoding, content, digest FROM files WHERE path = ?',
+            (os.path.abspath(file_path),)
+        ).fetchone()
+        if row is None or row[:3] != (st.st_size, st.st_mtime_ns, st.st_ino):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {'status': row[3], 'encoding': row[4], 'content': row[5], 'digest': row[6], 'size': row[0]}
+
+    def store_many(self, folder_path, entries):
+        root = os.path.abspath(folder_path)
+        now = time.time()
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO files '
+            '(path, root, size, mtime_ns, inode, status, encoding, content, digest, scanned_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [
+                (os.path.abspath(file_path), root, st.st_size, st.st_mtime_ns, st.st_ino,
+                 status, encoding, content, digest, now)
+                for file_path, st, status, encoding, content, digest in entries if status in CACHEABLE_STATUSES
+            ]
+        )
+        self.conn.commit()
+
+    def prune(self, folder_path, seen_paths):
+        root = os.path.abspath(folder_path)
+        seen = {os.path.abspath(p) for p in seen_paths}
+        stale = [(path,) for (path,) in self.conn.execute('SELECT path FROM files WHERE root = ?', (root,))
+                 if path not in seen]
+        self.conn.executemany('DELETE FROM files WHERE path = ?', stale)
+        self.conn.commit()
+        return len(stale)
+
+    def enforce_limit(self):
+        if not self.max_size:
+            return 0
+        total = self.conn.execute('SELECT COALESCE(SUM(LENGTH(content)), 0) FROM files').fetchone()[0]
+        if total <= self.max_size:
+            return 0
+        evicted = []
+        for path, length in self.conn.execute('SELECT path, COALESCE(LENGTH(content), 0) FROM files '
+                                              'ORDER BY scanned_at'):
+            if total <= self.max_size:
+                break
+            evicted.append((path,))
+            total -= length
+        self.conn.executemany('DELETE FROM files WHERE path = ?', evicted)
+        self.conn.commit()
+        return len(evicted)
@@ -0,0 +1,408 @@
+import argparse
+import asyncio
+import cProfile
+import os
+import json
+import pstats
+import signal
+import sys
+
+from .bench import REGRESSION_THRESHOLD, compare, default_spec, load_result, run_benchmark, save_result
+from .budget import TOKENIZERS, export_budgeted, pack
+from .cache import MAX_CACHE_SIZE, ScanCache, cache_path_for
+from .config import CONFIG_FILE, load_config
+from .daemon import Daemon, default_socket_path, request
+from .exporters import BINARY_FORMATS, COMPRESSIONS, WRITERS, export_file
+from .gitindex import GitError
+from .processor import TRUNCATE_MODES
+from .scanner import EXECUTORS, Scanner
+from .search import search_content
+from .stats import ScanStats, timed
+from .watch import DEBOUNCE, POLL_INTERVAL, WatchSession, exclude_export, rewrite_export
+
+CLIENT_OPS = ('roots', 'scan', 'remove', 'files', 'search', 'export', 'shutdown')
+
+
+def add_scan_options(parser):
+    parser.add_argument('folder', help='folder to scan')
+    parser.add_argument('--config', default=CONFIG_FILE, help=f'config file (default: {CONFIG_FILE})')
+    parser.add_argument('--max-content-length', type=int, help='truncate file content to N characters')
+    parser.add_argument('--max-file-size', type=int, help='skip files larger than N kb')
+    parser.add_argument('--truncate', choices=TRUNCATE_MODES,
+                        help='keep the head, or the head and the tail, of content longer than the limit')
+    parser.add_argument('--exclude', action='append', default=[], metavar='NAME',
+                        help='file name excluded from truncation (repeatable)')
+    parser.add_argument('--ignore', action='append', default=[], metavar='PATTERN',
+                        help='ignore pattern (repeatable)')
+    parser.add_argument('--executor', choices=EXECUTORS, help='pool used to read and decode files')
+    parser.add_argument('--workers', type=int, help='number of pool workers')
+    parser.add_argument('--lazy-content', action='store_true',
+                        help='do not keep file contents in memory, read them again while exporting')
+    parser.add_argument('--no-gitignore', action='store_true', help='do not read .gitignore/.ignore files')
+    parser.add_argument('--no-cache', action='store_true', help='do not read or update the scan cache')
+    parser.add_argument('--git', action='store_true', help='take the file list from the git index instead of walking')
+    parser.add_argument('--changed-since', metavar='REF',
+                        help='only files that differ from the git commit REF, plus untracked files')
+    parser.add_argument('--stats', action='store_true',
+                        help='print per-stage latencies and the slowest files and folders')
+    parser.add_argument('--trace', metavar='FILE', help='write per-stage latencies and the slowest files as JSON')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='save a cProfile profile of the main thread; pool workers show up as waits')
+
+
+def add_address_options(parser):
+    parser.add_argument('--socket', metavar='PATH', help=f'Unix socket path (default: {default_socket_path()})')
+    parser.add_argument('--port', type=int, help='use TCP on 127.0.0.1:PORT instead of a Unix socket')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='codemerger', description='Merge a project tree into Markdown or JSON.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scan = subparsers.add_parser('scan', help='scan a folder and export the result')
+    add_scan_options(scan)
+    scan.add_argument('--format', choices=sorted(WRITERS), default='md', help='export format (default: md)')
+    scan.add_argument('-o', '--output', default='-', help='output file, "-" for stdout (default)')
+    scan.add_argument('--compress', choices=COMPRESSIONS,
+                      help='compress the output file (default: by its .gz/.zst suffix)')
+    scan.add_argument('--no-dedupe', action='store_true',
+                      help='write the content of identical files every time instead of once')
+    scan.add_argument('--token-budget', type=int, metavar='TOKENS',
+                      help='pack files by priority into parts of at most TOKENS tokens')
+    scan.add_argument('--max-parts', type=int, help='number of numbered output parts (default: 1)')
+    scan.add_argument('--tokenizer', help=f'token counter: {", ".join(TOKENIZERS)} or tiktoken:<encoding> '
+                                          '(default: bytes)')
+    scan.add_argument('--priority', action='append', default=[], metavar='PATTERN',
+                      help='path pattern exported first when packing (repeatable, in priority order)')
+
+    watch = subparsers.add_parser('watch', help='scan a folder, then keep the export up to date as files change')
+    add_scan_options(watch)
+    watch.add_argument('--format', choices=sorted(WRITERS), default='md', help='export format (default: md)')
+    watch.add_argument('-o', '--output', required=True, help='export file rewritten after every change')
+    watch.add_argument('--no-dedupe', action='store_true',
+                       help='write the content of identical files every time instead of once')
+    watch.add_argument('--debounce', type=float,
+                       help=f'seconds without changes before the export is rewritten (default: {DEBOUNCE})')
+    watch.add_argument('--poll', action='store_true', help='poll the tree instead of using inotify')
+    watch.add_argument('--interval', type=float, default=POLL_INTERVAL,
+                       help=f'polling interval in seconds (default: {POLL_INTERVAL})')
+
+    search = subparsers.add_parser('search', help='scan a folder and print lines matching a query')
+    add_scan_options(search)
+    search.add_argument('query', help='text to search for')
+    search.add_argument('--regex', action='store_true', help='treat the query as a regular expression')
+    search.add_argument('--case-sensitive', action='store_true', help='match case exactly')
+    search.add_argument('--limit', type=int, help='stop after N matching lines')
+
+    serve = subparsers.add_parser('serve', help='keep folders scanned and answer requests over a local socket')
+    serve.add_argument('--config', default=CONFIG_FILE, help=f'config file (default: {CONFIG_FILE})')
+    serve.add_argument('--root', action='append', default=[], metavar='FOLDER',
+                       help='folder scanned at startup, in addition to daemon_roots from the config (repeatable)')
+    add_address_options(serve)
+    serve.add_argument('--no-cache', action='store_true', help='do not read or update the scan cache')
+    serve.add_argument('--debounce', type=float,
+                       help=f'seconds without changes before they are applied (default: {DEBOUNCE})')
+    serve.add_argument('--poll', action='store_true', help='poll the folders instead of using inotify')
+    serve.add_argument('--interval', type=float, default=POLL_INTERVAL,
+                       help=f'polling interval in seconds (default: {POLL_INTERVAL})')
+
+    client = subparsers.add_parser('client', help='send one request to a running daemon')
+    client.add_argument('op', choices=CLIENT_OPS, help='request to send')
+    client.add_argument('folder', nargs='?', help='folder the request is about')
+    add_address_options(client)
+    client.add_argument('--query', help='text to search for (search), fuzzy path query (files)')
+    client.add_argument('--regex', action='store_true', help='treat the query as a regular expression')
+    client.add_argument('--case-sensitive', action='store_true', help='match case exactly')
+    client.add_argument('--limit', type=int, help='maximum number of results')
+    client.add_argument('--rescan', action='store_true', help='scan the folder again from scratch (scan)')
+    client.add_argument('--format', choices=sorted(WRITERS), default='md', help='export format (default: md)')
+    client.add_argument('-o', '--output', help='file the daemon writes the export to (default: stdout)')
+    client.add_argument('--no-dedupe', action='store_true',
+                        help='write the content of identical files every time instead of once')
+
+    bench = subparsers.add_parser('bench', help='time scan stages on a generated synthetic tree')
+    spec = default_spec()
+    bench.add_argument('folder', nargs='?',
+                       help='where to generate the tree and keep it between runs (default: a temporary folder)')
+    bench.add_argument('--files', type=int, default=spec['files'], help=f"number of files (default: {spec['files']})")
+    bench.add_argument('--depth', type=int, default=spec['depth'], help=f"folder depth (default: {spec['depth']})")
+    bench.add_argument('--fanout', type=int, default=spec['fanout'],
+                       help=f"subfolders per folder (default: {spec['fanout']})")
+    bench.add_argument('--median-size', type=int, default=spec['median_size'], metavar='BYTES',
+                       help=f"median file size, sizes are log-normal (default: {spec['median_size']})")
+    bench.add_argument('--binary-ratio', type=float, default=spec['binary_ratio'],
+                       help=f"share of binary files (default: {spec['binary_ratio']})")
+    bench.add_argument('--legacy-ratio', type=float, default=spec['legacy_ratio'],
+                       help=f"share of cp1251/latin-1/shift_jis text files (default: {spec['legacy_ratio']})")
+    bench.add_argument('--ignored-files', type=int, default=spec['ignored_files'],
+                       help=f"files inside an ignored node_modules folder (default: {spec['ignored_files']})")
+    bench.add_argument('--seed', type=int, default=spec['seed'], help=f"random seed (default: {spec['seed']})")
+    bench.add_argument('--repeat', type=int, default=3, help='runs per stage, the best one is kept (default: 3)')
+    bench.add_argument('--executor', choices=EXECUTORS, default='thread', help='pool used by the scan stage')
+    bench.add_argument('--workers', type=int, help='number of pool workers')
+    bench.add_argument('-o', '--output', default='-', help='result JSON file, "-" for stdout (default)')
+    bench.add_argument('--baseline', help='result JSON of an earlier run to compare with')
+    bench.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                       help=f'slowdown that counts as a regression (default: {REGRESSION_THRESHOLD})')
+    return parser
+
+
+def make_scanner(args):
+    config = load_config(args.config, create=False)
+    cache = None
+    if config.get('use_cache', True) and not args.no_cache:
+        cache = ScanCache(cache_path_for(args.config), config.get('max_cache_size', MAX_CACHE_SIZE))
+    scanner = Scanner.from_config(config, cache=cache)
+    if args.max_content_length is not None:
+        scanner.max_content_length = args.max_content_length
+    if args.max_file_size is not None:
+        scanner.max_file_size = args.max_file_size * 1024
+    if args.truncate:
+        scanner.truncate_mode = args.truncate
+    scanner.excluded_files.update(args.exclude)
+    scanner.ignore_patterns.extend(args.ignore)
+    if args.executor:
+        scanner.executor = args.executor
+    if args.workers:
+        scanner.workers = args.workers
+    if args.lazy_content:
+        scanner.keep_content = False
+    if args.no_gitignore:
+        scanner.use_gitignore = False
+    if args.git:
+        scanner.use_git_index = True
+    scanner.changed_since = args.changed_since
+    if args.stats or args.trace:
+        scanner.stats = ScanStats()
+    # Для разового запуска индекс дороже линейного поиска
+    scanner.content_index = False
+    return scanner, cache, config
+
+
+def print_scan_stats(processed_files, errors, cache, progress=None, dedupe=False):
+    cache_note = f", Cached: {cache.hits}" if cache else ""
+    duplicates_note = ""
+    if dedupe and progress is not None and progress.duplicates:
+        duplicates_note = f", Duplicates: {progress.duplicates} ({progress.duplicate_bytes // 1024} kb saved)"
+    partial_note = ""
+    if progress is not None and progress.partial_reads:
+        partial_note = f", Truncated reads: {progress.partial_reads} ({progress.bytes_not_read // 1024} kb not read)"
+    print(f"Files: {processed_files}, Errors: {errors}{cache_note}{duplicates_note}{partial_note}", file=sys.stderr)
+
+
+def report_stats(args, scanner):
+    stats = scanner.stats
+    if stats is None:
+        return
+    if args.stats:
+        for line in stats.summary():
+            print(line, file=sys.stderr)
+    if args.trace:
+        progress = scanner.progress
+        stats.write_trace(args.trace, folder=args.folder, files=progress.processed, errors=progress.errors,
+                          bytes_read=progress.bytes_read, seconds=round(progress.elapsed(), 3))
+
+
+def stdout_for(fmt):
+    return sys.stdout.buffer if fmt in BINARY_FORMATS else sys.stdout
+
+
+def run_budgeted_scan(args, scanner, config, dedupe):
+    budget = args.token_budget or config.get('token_budget')
+    max_parts = args.max_parts or config.get('max_parts') or 1
+    tokenizer = args.tokenizer or config.get('tokenizer', 'bytes')
+    priority = args.priority or config.get('priority_patterns', [])
+    if args.output == '-':
+        if max_parts > 1:
+            print("codemerger: --max-parts needs -o", file=sys.stderr)
+            return 2
+        parts, dropped = pack(scanner.structure, budget, 1, tokenizer, priority, args.format, args.folder)
+        WRITERS[args.format](parts[0], args.folder, stdout_for(args.format), dedupe)
+        paths = ['-']
+    else:
+        paths, dropped = export_budgeted(scanner.structure, args.folder, args.output, args.format, budget,
+                                         max_parts, tokenizer, priority, dedupe, args.compress)
+    print(f"Parts: {len(paths)}, Dropped: {len(dropped)}", file=sys.stderr)
+    return 0
+
+
+def run_scan(args):
+    if args.compress and args.output == '-':
+        print("codemerger: --compress needs -o", file=sys.stderr)
+        return 2
+    scanner, cache, config = make_scanner(args)
+    processed_files, errors = scanner.scan(args.folder)
+    dedupe = config.get('dedupe_content', True) and not args.no_dedupe
+    if args.token_budget or config.get('token_budget'):
+        with timed(scanner.stats, 'export'):
+            status = run_budgeted_scan(args, scanner, config, dedupe)
+        print_scan_stats(processed_files, errors, cache, scanner.progress, dedupe)
+        report_stats(args, scanner)
+        return status
+    with timed(scanner.stats, 'export'):
+        if args.output == '-':
+            WRITERS[args.format](scanner.structure, args.folder, stdout_for(args.format), dedupe)
+        else:
+            export_file(scanner.structure, args.folder, args.output, args.format, dedupe, args.compress)
+    print_scan_stats(processed_files, errors, cache, scanner.progress, dedupe)
+    report_stats(args, scanner)
+    return 0
+
+
+def run_search(args):
+    scanner, cache, config = make_scanner(args)
+    processed_files, errors = scanner.scan(args.folder)
+    structure = scanner.structure
+    hits = search_content(structure, args.query, regex=args.regex, case_sensitive=args.case_sensitive,
+                          limit=args.limit)
+    for hit in hits:
+        print(f"{structure.rel_path(hit.record)}:{hit.line_no}: {hit.line}")
+    print_scan_stats(processed_files, errors, cache, scanner.progress)
+    report_stats(args, scanner)
+    return 0 if hits else 1
+
+
+def run_watch(args):
+    scanner, cache, config = make_scanner(args)
+    exclude_export(scanner, args.output)
+    processed_files, errors = scanner.scan(args.folder)
+    dedupe = config.get('dedupe_content', True) and not args.no_dedupe
+    with timed(scanner.stats, 'export'):
+        rewrite_export(scanner.structure, args.folder, args.output, args.format, dedupe)
+    print_scan_stats(processed_files, errors, cache, scanner.progress, dedupe)
+    report_stats(args, scanner)
+
+    def report(removed, added):
+        print(f"Updated {args.output}: -{len(removed)} +{len(added)}", file=sys.stderr)
+
+    debounce = args.debounce or config.get('watch_debounce') or DEBOUNCE
+    poll = args.poll or config.get('watch_poll', False)
+    session = WatchSession(scanner, debounce=debounce, poll=poll, interval=args.interval,
+                           export_path=args.output, export_format=args.format, dedupe=dedupe, on_update=report)
+    # SIGTERM завершает наблюдение так же аккуратно, как Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: session.stop())
+    try:
+        session.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run_serve(args):
+    if args.port is None and not hasattr(asyncio, 'start_unix_server'):
+        print("codemerger: Unix sockets are not available here, use --port", file=sys.stderr)
+        return 2
+    config = load_config(args.config, create=False)
+    cache_path = None if args.no_cache else cache_path_for(args.config)
+    debounce = args.debounce or config.get('watch_debounce') or DEBOUNCE
+    poll = args.poll or config.get('watch_poll', False)
+    daemon = Daemon(config, cache_path, debounce, poll, args.interval, log=lambda line: print(line, file=sys.stderr))
+    roots = list(dict.fromkeys(config.get('daemon_roots', []) + args.root))
+    try:
+        asyncio.run(daemon.serve(args.socket or default_socket_path(), args.port, roots))
+    except OSError as e:
+        print(f"codemerger: {e}", file=sys.stderr)
+        return 2
+    return 0
+
+
+def run_client(args):
+    payload = {'op': args.op}
+    if args.folder:
+        # У демона своя текущая папка, поэтому пути передаются абсолютными
+        payload['root'] = os.path.abspath(args.folder)
+    elif args.op not in ('roots', 'shutdown'):
+        print(f"codemerger: {args.op} needs a folder", file=sys.stderr)
+        return 2
+    for key in ('query', 'limit'):
+        if getattr(args, key) is not None:
+            payload[key] = getattr(args, key)
+    if args.op == 'search':
+        if not args.query:
+            print("codemerger: search needs --query", file=sys.stderr)
+            return 2
+        payload.update(regex=args.regex, case_sensitive=args.case_sensitive)
+    elif args.op == 'scan':
+        payload['rescan'] = args.rescan
+    elif args.op == 'export':
+        payload['format'] = args.format
+        if args.output:
+            payload['output'] = os.path.abspath(args.output)
+        if args.no_dedupe:
+            payload['dedupe'] = False
+    try:
+        response = request(payload, args.socket, args.port)
+    except OSError as e:
+        print(f"codemerger: cannot reach the daemon: {e}", file=sys.stderr)
+        return 2
+    if not response['ok']:
+        print(f"codemerger: {response['error']}", file=sys.stderr)
+        return 2
+    result = response['result']
+    print(f"{response['ms']:.1f} ms", file=sys.stderr)
+    if args.op == 'search':
+        for hit in result:
+            print(f"{hit['path']}:{hit['line']}: {hit['text']}")
+        return 0 if result else 1
+    if args.op == 'files':
+        for item in result:
+            print(item['path'])
+    elif args.op == 'export' and 'content' in result:
+        sys.stdout.write(result['content'])
+    else:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write('\n')
+    return 0
+
+
+def run_bench(args):
+    spec = {'files': args.files, 'depth': args.depth, 'fanout': args.fanout, 'median_size': args.median_size,
+            'binary_ratio': args.binary_ratio, 'legacy_ratio': args.legacy_ratio,
+            'ignored_files': args.ignored_files, 'seed': args.seed}
+    try:
+        result = run_benchmark(args.folder, spec, max(args.repeat, 1), args.executor, args.workers,
+                               log=lambda line: print(line, file=sys.stderr))
+    except FileExistsError as e:
+        print(f"codemerger: {e}", file=sys.stderr)
+        return 2
+    if args.output == '-':
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write('\n')
+    else:
+        save_result(result, args.output)
+    if not args.baseline:
+        return 0
+    baseline = load_result(args.baseline)
+    if baseline.get('tree') != result['tree']:
+        print("codemerger: baseline was measured on a different tree, times are not comparable", file=sys.stderr)
+    rows, regressions = compare(result, baseline, args.threshold)
+    for name, base, current, change in rows:
+        change_note = f"{change:+.1%}" if change is not None else "new"
+        base_note = f"{base:.3f}s" if base is not None else "-"
+        print(f"{name:14} {base_note:>10} -> {current:.3f}s {change_note:>8}", file=sys.stderr)
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    commands = {'scan': run_scan, 'search': run_search, 'watch': run_watch, 'serve': run_serve, 'client': run_client,
+                'bench': run_bench}
+    if args.command not in commands:
+        return 1
+    profile_path = getattr(args, 'profile', None)
+    profiler = cProfile.Profile() if profile_path else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        return commands[args.command](args)
+    except GitError as e:
+        print(f"codemerger: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(15)
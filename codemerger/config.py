@@ -0,0 +1,61 @@
+import json
+import os
+
+from .cache import MAX_CACHE_SIZE
+
+# Константы
+MAX_FILE_SIZE = None
+MAX_CONTENT_LENGTH = None
+CONFIG_FILE = 'codemerger_config.json'
+BINARY_EXTENSIONS = {
+    '.exe', '.dll', '.jpg', '.png', '.zip', '.pdf', '.bin', '.ico',
+    '.mp3', '.mp4'
+}
+
+
+def default_config():
+    return {
+        'max_content_length': None,
+        'max_file_size': None,
+        'truncate_mode': 'head',
+        'excluded_files': [],
+        'ignore_patterns': [],
+        'use_gitignore': True,
+        'use_git_index': False,
+        'walker_threads': None,
+        'encodings': {},
+        'executor': 'thread',
+        'workers': None,
+        'chunk_size': None,
+        'keep_content': True,
+        'content_index': True,
+        'dedupe_content': True,
+        'token_budget': None,
+        'max_parts': 1,
+        'tokenizer': 'bytes',
+        'priority_patterns': [],
+        'watch_debounce': 0.5,
+        'watch_poll': False,
+        'scan_trace': None,
+        'daemon_roots': [],
+        'use_cache': True,
+        'max_cache_size': MAX_CACHE_SIZE
+    }
+
+
+def load_config(path=CONFIG_FILE, create=True):
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            pass
+    config = default_config()
+    if create:
+        save_config(config, path)
+    return config
+
+
+def save_config(config, path=CONFIG_FILE):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
@@ -0,0 +1,433 @@
+import asyncio
+import contextlib
+import getpass
+import hmac
+import io
+import json
+import os
+import re
+import secrets
+import signal
+import socket
+import tempfile
+import threading
+import time
+import traceback
+
+from .cache import MAX_CACHE_SIZE, ScanCache
+from .exporters import BINARY_FORMATS, WRITERS, export_file
+from .scanner import Scanner
+from .search import NameIndex, search_content
+from .watch import DEBOUNCE, POLL_INTERVAL, WatchSession, exclude_export
+
+SOCKET_NAME = 'codemerger.sock'
+LOCALHOST = '127.0.0.1'
+# Запрос - одна строка JSON; длиннее строка не читается
+REQUEST_LIMIT = 1024 * 1024
+SEARCH_LIMIT = 1000
+FILES_LIMIT = 100
+
+
+class RequestError(ValueError):
+    pass
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, SOCKET_NAME)
+    user = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+    return os.path.join(tempfile.gettempdir(), f'codemerger-{user}.sock')
+
+
+def prepare_socket(path):
+    # Оставшийся от упавшего демона сокет удаляется, живой - нет
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise FileExistsError(f"Another daemon is listening on {path}")
+
+
+def token_path(port):
+    # Токен для TCP лежит рядом с сокетом по умолчанию, в файле, который читает только владелец
+    base = os.path.splitext(default_socket_path())[0]
+    return f"{base}-{port}.token"
+
+
+def write_token(path, token):
+    # Чужой файл на этом месте не переиспользуется: старый удаляется, новый создаётся с правами 0600
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w', encoding='ascii') as f:
+        f.write(token)
+
+
+def read_token(port):
+    with open(token_path(port), 'r', encoding='ascii') as f:
+        return f.read().strip()
+
+
+def export_path(root, output):
+    # Выгрузка пишется только внутрь зарегистрированной папки: запрос не перезапишет произвольный файл.
+    # Относительный путь считается от папки, ссылки раскрываются до проверки
+    folder = os.path.realpath(root.folder_path)
+    path = os.path.realpath(os.path.join(folder, output))
+    if path == folder or os.path.commonpath([folder, path]) != folder:
+        raise RequestError(f"Output must be inside {root.folder_path}")
+    return os.path.join(root.folder_path, os.path.relpath(path, folder))
+
+
+class Root:
+    # Папка, которую демон держит просканированной и обновляет по событиям файловой системы
+    def __init__(self, folder_path, scanner):
+        self.folder_path = folder_path
+        self.scanner = scanner
+        # Скан, обновления от наблюдения и запросы к папке идут по очереди
+        self.lock = threading.Lock()
+        self.name_index = NameIndex()
+        self.session = None
+        self.scanned_at = None
+        self.scan_seconds = None
+        self.scanning = False
+        self.updates = 0
+
+    def info(self):
+        structure = self.scanner.structure
+        return {
+            'root': self.folder_path,
+            'files': len(structure),
+            'counts': structure.counts(),
+            'scanned_at': self.scanned_at,
+            'scan_seconds': self.scan_seconds,
+            'updates': self.updates,
+            'scanning': self.scanning,
+            'watching': self.session is not None
+        }
+
+    def stop_watch(self):
+        if self.session is not None:
+            self.session.stop()
+            self.session = None
+
+
+class Daemon:
+    def __init__(self, config, cache_path=None, debounce=DEBOUNCE, poll=False, interval=POLL_INTERVAL, log=None):
+        self.config = config
+        self.cache_path = cache_path
+        self.debounce = debounce
+        self.poll = poll
+        self.interval = interval
+        self.log = log
+        self.roots = {}
+        self.roots_lock = threading.Lock()
+        # Полные сканы идут по одному: у кеша в SQLite один писатель, а процессор и так занят
+        self.scan_lock = threading.Lock()
+        self.stopped = None
+        # Задаётся при работе по TCP: без него запрос мог бы прислать любой локальный процесс или страница в браузере
+        self.token = None
+        self.handlers = {
+            'roots': self.op_roots,
+            'scan': self.op_scan,
+            'remove': self.op_remove,
+            'files': self.op_files,
+            'search': self.op_search,
+            'export': self.op_export
+        }
+
+    def make_scanner(self):
+        cache = None
+        if self.cache_path and self.config.get('use_cache', True):
+            cache = ScanCache(self.cache_path, self.config.get('max_cache_size', MAX_CACHE_SIZE))
+        return Scanner.from_config(self.config, cache=cache)
+
+    def root(self, request):
+        folder_path = request.get('root')
+        if not folder_path:
+            raise RequestError("Missing root")
+        folder_path = os.path.abspath(folder_path)
+        with self.roots_lock:
+            root = self.roots.get(folder_path)
+            if root is None:
+                if not os.path.isdir(folder_path):
+                    raise RequestError(f"Not a folder: {folder_path}")
+                root = self.roots[folder_path] = Root(folder_path, self.make_scanner())
+        return root
+
+    def ensure_scanned(self, root, rescan=False):
+        # Вызывается под root.lock; первый запрос к папке сканирует её, следующие берут готовое
+        if root.scanned_at is not None and not rescan:
+            return
+        root.stop_watch()
+        root.scanning = True
+        try:
+            with self.scan_lock:
+                started = time.perf_counter()
+                root.scanner.scan(root.folder_path)
+                root.scan_seconds = round(time.perf_counter() - started, 3)
+        finally:
+            root.scanning = False
+        if root.scanner.cancelled.is_set():
+            # Демон останавливается: половина скана не считается готовой
+            return
+        structure = root.scanner.structure
+        root.name_index = NameIndex()
+        root.name_index.add_records(structure, structure)
+        root.scanned_at = time.time()
+        if self.log:
+            self.log(f"Scanned {root.folder_path}: {len(structure)} files in {root.scan_seconds}s")
+        self.start_watch(root)
+
+    def start_watch(self, root):
+        def update(removed, added):
+            # Из потока наблюдения, уже под root.lock
+            structure = root.scanner.structure
+            root.name_index.remove(removed)
+            root.name_index.add_records(structure, added)
+            root.updates += 1
+            if self.log:
+                self.log(f"Updated {root.folder_path}: -{len(removed)} +{len(added)}")
+
+        root.session = WatchSession(root.scanner, debounce=self.debounce, poll=self.poll, interval=self.interval,
+                                    on_update=update, lock=root.lock)
+        threading.Thread(target=root.session.run, daemon=True).start()
+
+    @contextlib.contextmanager
+    def scanned_root(self, request):
+        root = self.root(request)
+        with root.lock:
+            self.ensure_scanned(root)
+            yield root
+
+    def op_roots(self, request):
+        # Без root.lock: список папок отвечает и во время их скана, счётчики при этом промежуточные
+        with self.roots_lock:
+            roots = list(self.roots.values())
+        return [root.info() for root in roots]
+
+    def op_scan(self, request):
+        root = self.root(request)
+        with root.lock:
+            self.ensure_scanned(root, bool(request.get('rescan')))
+            return root.info()
+
+    def op_remove(self, request):
+        folder_path = os.path.abspath(request.get('root') or '')
+        with self.roots_lock:
+            root = self.roots.pop(folder_path, None)
+        if root is None:
+            raise RequestError(f"Not registered: {folder_path}")
+        with root.lock:
+            root.stop_watch()
+        return {'root': folder_path}
+
+    def op_files(self, request):
+        limit = request.get('limit') or FILES_LIMIT
+        query = request.get('query')
+        with self.scanned_root(request) as root:
+            structure = root.scanner.structure
+            if query:
+                records = root.name_index.search(query, limit)
+            else:
+                records = []
+                for record in structure:
+                    if len(records) >= limit:
+                        break
+                    records.append(record)
+            return [{'path': structure.rel_path(record), 'status': record.status, 'size': record.size,
+                     'encoding': record.encoding} for record in records]
+
+    def op_search(self, request):
+        query = request.get('query')
+        if not query:
+            raise RequestError("Missing query")
+        with self.scanned_root(request) as root:
+            structure = root.scanner.structure
+            try:
+                hits = search_content(structure, query, regex=bool(request.get('regex')),
+                                      case_sensitive=bool(request.get('case_sensitive')),
+                                      limit=request.get('limit') or SEARCH_LIMIT)
+            except re.error as e:
+                raise RequestError(f"Invalid pattern: {e}") from None
+            return [{'path': structure.rel_path(hit.record), 'line': hit.line_no, 'text': hit.line} for hit in hits]
+
+    def op_export(self, request):
+        fmt = request.get('format') or 'md'
+        if fmt not in WRITERS:
+            raise RequestError(f"Unknown format: {fmt}")
+        output = request.get('output')
+        if not output and fmt in BINARY_FORMATS:
+            raise RequestError(f"Format {fmt} needs an output file")
+        dedupe = bool(request.get('dedupe', self.config.get('dedupe_content', True)))
+        with self.scanned_root(request) as root:
+            structure = root.scanner.structure
+            if output:
+                output = export_path(root, output)
+                exclude_export(root.scanner, output)
+                export_file(structure, root.folder_path, output, fmt, dedupe)
+                return {'output': output, 'files': len(structure)}
+            out = io.StringIO()
+            WRITERS[fmt](structure, root.folder_path, out, dedupe)
+            return {'content': out.getvalue(), 'files': len(structure)}
+
+    def parse(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            raise RequestError(f"Bad request: {e}") from None
+        if not isinstance(request, dict):
+            raise RequestError("Request must be a JSON object")
+        if self.token is not None:
+            token = str(request.get('token', '')).encode('utf-8')
+            if not hmac.compare_digest(token, self.token.encode('ascii')):
+                raise RequestError("Bad token")
+        return request
+
+    async def respond(self, request):
+        started = time.perf_counter()
+        op = request.get('op')
+        try:
+            if op == 'shutdown':
+                self.stopped.set()
+                result = {}
+            else:
+                handler = self.handlers.get(op)
+                if handler is None:
+                    raise RequestError(f"Unknown op: {op}")
+                # Сканы и экспорт блокируют, поэтому идут в пуле потоков, а цикл событий обслуживает другие запросы
+                result = await asyncio.get_running_loop().run_in_executor(None, handler, request)
+            response = {'ok': True, 'result': result}
+        except (ValueError, TypeError, OSError) as e:
+            # RequestError, GitError, параметры не того типа и ошибки записи экспорта
+            response = {'ok': False, 'error': str(e)}
+        except Exception as e:
+            # Непредвиденная ошибка (ImportError необязательного формата, sqlite3.Error кеша...) не обрывает
+            # соединение: клиент получает ответ, а подробности остаются в журнале демона
+            if self.log:
+                self.log(f"{op} failed: {traceback.format_exc().rstrip()}")
+            response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        if 'id' in request:
+            response['id'] = request['id']
+        response['ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return response
+
+    async def handle(self, reader, writer):
+        # JSON Lines: по запросу на строку, ответы в том же порядке
+        try:
+            while not self.stopped.is_set():
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(json.dumps({'ok': False, 'error': "Request too long"}).encode('utf-8') + b'\n')
+                    break
+                if not line:
+                    break
+                try:
+                    request = self.parse(line)
+                except RequestError as e:
+                    # Не JSON или без токена - это не наш клиент (например, HTTP-запрос страницы в браузере):
+                    # соединение закрывается на первой же строке
+                    writer.write(json.dumps({'ok': False, 'error': str(e)}).encode('utf-8') + b'\n')
+                    break
+                response = await self.respond(request)
+                writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None, port=None, roots=(), ready=None):
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        if port is not None:
+            # Только localhost: содержимое файлов не должно быть доступно по сети
+            server = await asyncio.start_server(self.handle, LOCALHOST, port, limit=REQUEST_LIMIT)
+            port = server.sockets[0].getsockname()[1]
+            address = f"{LOCALHOST}:{port}"
+            self.token = secrets.token_hex(16)
+            try:
+                write_token(token_path(port), self.token)
+            except OSError:
+                server.close()
+                raise
+        else:
+            prepare_socket(socket_path)
+            # Сокет сразу создаётся доступным только владельцу
+            umask = os.umask(0o177)
+            try:
+                server = await asyncio.start_unix_server(self.handle, socket_path, limit=REQUEST_LIMIT)
+            finally:
+                os.umask(umask)
+            address = socket_path
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stopped.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows и запуск не из главного потока
+                pass
+        if self.log:
+            self.log(f"Listening on {address}")
+            if port is not None:
+                self.log(f"Token in {token_path(port)}")
+        if ready is not None:
+            ready(address)
+        # Заранее заданные папки сканируются в фоне, запросы принимаются сразу
+        preload = [loop.run_in_executor(None, self.preload, folder_path) for folder_path in roots]
+        try:
+            async with server:
+                await self.stopped.wait()
+        finally:
+            self.close()
+            if port is None and os.path.exists(socket_path):
+                os.remove(socket_path)
+            if port is not None:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(token_path(port))
+            for future in preload:
+                future.cancel()
+
+    def preload(self, folder_path):
+        try:
+            self.op_scan({'root': folder_path})
+        except (ValueError, OSError) as e:
+            if self.log:
+                self.log(f"Cannot scan {folder_path}: {e}")
+
+    def close(self):
+        # Идущие сканы прерываются: иначе выход ждал бы их в пуле потоков
+        with self.roots_lock:
+            roots = list(self.roots.values())
+        for root in roots:
+            root.scanner.cancel()
+            root.stop_watch()
+
+
+def request(payload, socket_path=None, port=None, timeout=None):
+    # Клиент для скриптов: один запрос, один ответ
+    if port is not None:
+        if 'token' not in payload:
+            payload = dict(payload, token=read_token(port))
+        sock = socket.create_connection((LOCALHOST, port), timeout)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path or default_socket_path())
+        except OSError:
+            sock.close()
+            raise
+    with sock:
+        sock.sendall(json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("Daemon closed the connection")
+    return json.loads(line)
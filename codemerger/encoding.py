@@ -0,0 +1,64 @@
+import codecs
+import fnmatch
+import os
+import re
+import time
+
+from charset_normalizer import detect
+
+# charset_normalizer получает не весь файл, а только его начало
+DETECT_SAMPLE_SIZE = 64 * 1024
+DETECT_CONFIDENCE = 0.9
+
+
+class EncodingDetector:
+    def __init__(self, pinned=None):
+        flags = re.IGNORECASE if os.name == 'nt' else 0
+        self.pinned = [(re.compile(fnmatch.translate(pattern), flags), encoding)
+                       for pattern, encoding in (pinned or {}).items()]
+        # Последняя найденная кодировка для пары (папка, расширение):
+        # соседние файлы одного типа почти всегда в одной кодировке
+        self.hints = {}
+
+    def pinned_encoding(self, rel_path):
+        for regex, encoding in self.pinned:
+            if regex.match(rel_path):
+                return encoding
+        return None
+
+    def decode(self, raw_data, rel_path):
+        # (текст, кодировка, секунды в charset_normalizer). Время возвращается, а не хранится в детекторе:
+        # один детектор используют все потоки процессора
+        encoding = self.pinned_encoding(rel_path) if self.pinned else None
+        if encoding:
+            return raw_data.decode(encoding, errors='replace'), encoding, 0.0
+
+        if raw_data.startswith(codecs.BOM_UTF8):
+            try:
+                return raw_data.decode('utf-8-sig'), 'utf-8-sig', 0.0
+            except UnicodeDecodeError:
+                pass
+        else:
+            try:
+                content = raw_data.decode('utf-8')
+                return content, 'ascii' if raw_data.isascii() else 'utf-8', 0.0
+            except UnicodeDecodeError:
+                pass
+
+        key = (os.path.dirname(rel_path), os.path.splitext(rel_path)[1].lower())
+        hint = self.hints.get(key)
+        if hint:
+            try:
+                return raw_data.decode(hint), hint, 0.0
+            except UnicodeDecodeError:
+                pass
+
+        start = time.perf_counter()
+        detected = detect(raw_data[:DETECT_SAMPLE_SIZE])
+        detect_time = time.perf_counter() - start
+        if detected['encoding'] and detected['confidence'] > DETECT_CONFIDENCE:
+            encoding = detected['encoding']
+            self.hints[key] = encoding
+        else:
+            encoding = 'utf-8'
+        return raw_data.decode(encoding, errors='replace'), encoding, detect_time
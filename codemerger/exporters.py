@@ -0,0 +1,220 @@
+import gzip
+import io
+import os
+import json
+from datetime import datetime
+
+from .packfile import PackWriter
+from .records import NO_CONTENT
+
+# Экспорт пишется по частям, поэтому большой буфер избавляет от мелких системных вызовов
+EXPORT_BUFFER_SIZE = 1024 * 1024
+COMPRESSIONS = ('gzip', 'zstd')
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+# Уровни, при которых сжатие не становится узким местом экспорта
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def dump_json(value, level):
+    # Повторяет вывод json.dump(indent=2) для значения на заданной глубине вложенности
+    return json.dumps(value, ensure_ascii=False, indent=2).replace('\n', '\n' + '  ' * level)
+
+
+class DuplicateTracker:
+    # Запоминает первое вхождение каждого содержимого в порядке записи экспорта
+    def __init__(self, structure):
+        self.structure = structure
+        self.first = {}
+
+    def original(self, record):
+        if record.digest is None:
+            return None
+        key = (record.digest, record.encoding)
+        first = self.first.get(key)
+        if first is None:
+            self.first[key] = record
+            return None
+        # Содержимое в памяти сверяем целиком: его могла по-разному обрезать max_content_length
+        if record.content_id != NO_CONTENT and first.content_id != NO_CONTENT:
+            if self.structure.content(record) != self.structure.content(first):
+                return None
+        return first
+
+
+def json_record(structure, f, original=None):
+    record = {
+        'name': f.name,
+        'path': structure.rel_path(f),
+        'extension': f.extension,
+        'status': f.status,
+        'content': structure.content(f) if original is None else None,
+        'encoding': f.encoding,
+        'error': f.error,
+        'size': f.size,
+        'last_modified': datetime.fromtimestamp(f.mtime).isoformat() if f.mtime is not None else None
+    }
+    if original is not None:
+        record['duplicate_of'] = structure.rel_path(original)
+    return record
+
+
+def export_metadata(structure, folder_path):
+    counts = structure.counts()
+    return {
+        'scanned_folder': folder_path,
+        'timestamp': datetime.now().isoformat(),
+        'total_files': sum(counts.values()),
+        'successful_files': counts['OK'],
+        'error_files': counts['ERROR'],
+        'binary_files': counts['BINARY'],
+        'skipped_files': counts['SKIPPED'],
+        'access_denied_files': counts['ACCESS_DENIED']
+    }
+
+
+def export_records(structure, dedupe=True):
+    tracker = DuplicateTracker(structure) if dedupe else None
+    for files in structure.values():
+        for f in files:
+            yield json_record(structure, f, tracker.original(f) if tracker else None)
+
+
+def write_json(structure, folder_path, out, dedupe=True):
+    tracker = DuplicateTracker(structure) if dedupe else None
+    metadata = export_metadata(structure, folder_path)
+    write = out.write
+    write('{\n  "metadata": ')
+    write(dump_json(metadata, 1))
+    write(',\n  "structure": {')
+    for i, (folder, files) in enumerate(structure.items()):
+        write(',\n    ' if i else '\n    ')
+        write(json.dumps(folder, ensure_ascii=False))
+        if not files:
+            write(': []')
+            continue
+        write(': [')
+        for j, f in enumerate(files):
+            write(',\n      ' if j else '\n      ')
+            original = tracker.original(f) if tracker else None
+            write(dump_json(json_record(structure, f, original), 3))
+        write('\n    ]')
+    write('\n  }\n}' if structure else '}\n}')
+
+
+def write_jsonl(structure, folder_path, out, dedupe=True):
+    # Первая строка - метаданные, дальше по одному файлу на строку
+    write = out.write
+    write(json.dumps({'metadata': export_metadata(structure, folder_path)}, ensure_ascii=False))
+    write('\n')
+    for record in export_records(structure, dedupe):
+        write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        write('\n')
+
+
+def write_msgpack(structure, folder_path, out, dedupe=True):
+    writer = PackWriter(out)
+    for record in export_records(structure, dedupe):
+        writer.add(record['path'], record)
+    writer.finish(export_metadata(structure, folder_path))
+
+
+def write_markdown_file(structure, file, write, original=None):
+    status_icon = f" `[{file.status}]`" if file.status != 'OK' else ''
+    error_note = f" (error: {file.error})" if file.error else ''
+    size_note = f" (size: {file.size // 1024}kb)" if file.size else ''
+    header = f"- `{file.extension}` **{file.name}**{status_icon}{error_note}{size_note} (encoding: {file.encoding})"
+    if original is not None:
+        write(f"{header} (duplicate of `{structure.rel_path(original)}`)\n")
+        return
+    write(header + "\n")
+    content = structure.content(file)
+    if content:
+        write(f"```{(file.extension[1:] if file.extension else 'text')}\n")
+        write(content)
+        write("\n```\n")
+
+
+def write_markdown(structure, folder_path, out, dedupe=True):
+    tracker = DuplicateTracker(structure) if dedupe else None
+    counts = structure.counts()
+    total_files = sum(counts.values())
+    write = out.write
+    write(f"# CodeMerger: {folder_path}\n\n")
+    write("## Summary\n")
+    write(
+        f"- **Total Files**: {total_files}\n"
+        f"- **Successful**: {counts['OK']}\n"
+        f"- **Errors**: {counts['ERROR']}\n"
+        f"- **Binary**: {counts['BINARY']}\n"
+        f"- **Skipped**: {counts['SKIPPED']}\n"
+        f"- **Access Denied**: {counts['ACCESS_DENIED']}\n"
+        f"- **Scan Date**: {datetime.now().strftime('%Y-%m-%d %H:%M')}\n\n"
+    )
+    write("## Structure\n")
+    for folder, files in sorted(structure.items()):
+        write(f"### {folder if folder else 'Root'}\n")
+        for file in sorted(files, key=lambda x: x.name):
+            write_markdown_file(structure, file, write, tracker.original(file) if tracker else None)
+
+
+def compression_for(file_path):
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(file_path)[1].lower())
+
+
+def format_for_path(file_path, default='json'):
+    name = file_path.lower()
+    for suffix in COMPRESSION_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return FORMAT_SUFFIXES.get(os.path.splitext(name)[1], default)
+
+
+def open_compressed(file_path, compression):
+    if compression == 'gzip':
+        return gzip.open(file_path, 'wb', compresslevel=GZIP_LEVEL)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression needs the zstandard package") from None
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(file_path, 'wb'))
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def open_export(file_path, binary=False, compression=None):
+    # Сжатие по умолчанию выбирается по расширению: .gz или .zst
+    compression = compression or compression_for(file_path)
+    if compression is None:
+        if binary:
+            return open(file_path, 'wb', buffering=EXPORT_BUFFER_SIZE)
+        return open(file_path, 'w', encoding='utf-8', buffering=EXPORT_BUFFER_SIZE)
+    stream = io.BufferedWriter(open_compressed(file_path, compression), EXPORT_BUFFER_SIZE)
+    return stream if binary else io.TextIOWrapper(stream, encoding='utf-8')
+
+
+def export_json(structure, folder_path, file_path, dedupe=True):
+    with open_export(file_path) as f:
+        write_json(structure, folder_path, f, dedupe)
+
+
+def export_markdown(structure, folder_path, file_path, dedupe=True):
+    with open_export(file_path) as f:
+        write_markdown(structure, folder_path, f, dedupe)
+
+
+def export_file(structure, folder_path, file_path, fmt, dedupe=True, compression=None):
+    with open_export(file_path, fmt in BINARY_FORMATS, compression) as f:
+        WRITERS[fmt](structure, folder_path, f, dedupe)
+
+
+WRITERS = {
+    'md': write_markdown,
+    'json': write_json,
+    'jsonl': write_jsonl,
+    'msgpack': write_msgpack
+}
+# Эти форматы пишутся в двоичный поток
+BINARY_FORMATS = {'msgpack'}
+FORMAT_SUFFIXES = {'.md': 'md', '.json': 'json', '.jsonl': 'jsonl', '.msgpack': 'msgpack', '.pack': 'msgpack'}
@@ -0,0 +1,206 @@
+import os
+import stat
+import struct
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .walker import default_walker_threads
+
+INDEX_HEADER = struct.Struct('>4sII')
+# ctime, mtime, dev, ino, mode, uid, gid, size, sha1, flags; нужны только mode и flags
+INDEX_ENTRY = struct.Struct('>8x8x4x4xI4x4x4x20xH')
+INDEX_EXTENDED = 0x4000
+INDEX_STAGE = 0x3000
+INDEX_NAME_MASK = 0xFFF
+INDEX_SKIP_WORKTREE = 0x4000
+# Разделённый и разреженный индекс читаем через git: в самом файле не все записи
+FALLBACK_EXTENSIONS = (b'link', b'sdir')
+GITLINK_MODE = 0o160000
+STAT_CHUNK_SIZE = 256
+
+
+class GitError(ValueError):
+    pass
+
+
+def find_repository(folder_path):
+    # (корень рабочего дерева, каталог git) или None, если папка не в репозитории
+    path = os.path.abspath(folder_path)
+    while True:
+        dot_git = os.path.join(path, '.git')
+        if os.path.isdir(dot_git):
+            return path, dot_git
+        if os.path.isfile(dot_git):
+            # Рабочие деревья git worktree и подмодули: файл с путём "gitdir: ..."
+            try:
+                with open(dot_git, 'r', encoding='utf-8') as f:
+                    line = f.readline().strip()
+            except OSError:
+                return None
+            if line.startswith('gitdir:'):
+                return path, os.path.normpath(os.path.join(path, line[len('gitdir:'):].strip()))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def read_varint(data, offset):
+    # Смещённое кодирование длины из индекса версии 4
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, offset
+
+
+def parse_index(data):
+    # Пути отслеживаемых файлов из .git/index версий 2-4 или None, если нужен git ls-files
+    signature, version, count = INDEX_HEADER.unpack_from(data)
+    if signature != b'DIRC' or version not in (2, 3, 4):
+        return None
+    offset = INDEX_HEADER.size
+    paths = []
+    previous = b''
+    for _ in range(count):
+        start = offset
+        mode, flags = INDEX_ENTRY.unpack_from(data, offset)
+        offset += INDEX_ENTRY.size
+        skip = False
+        if flags & INDEX_EXTENDED:
+            extended, = struct.unpack_from('>H', data, offset)
+            offset += 2
+            skip = bool(extended & INDEX_SKIP_WORKTREE)
+        if version == 4:
+            strip, offset = read_varint(data, offset)
+            end = data.index(b'\0', offset)
+            path = previous[:len(previous) - strip] + data[offset:end]
+            offset = end + 1
+        else:
+            length = flags & INDEX_NAME_MASK
+            end = offset + length if length < INDEX_NAME_MASK else data.index(b'\0', offset)
+            path = data[offset:end]
+            # Запись дополняется нулями до кратной 8 длины
+            offset = start + ((end - start + 8) & ~7)
+        previous = path
+        if stat.S_ISDIR(mode):
+            return None
+        # Конфликтующие стадии повторяют путь; подмодули и файлы вне рабочего дерева пропускаем
+        if skip or mode == GITLINK_MODE or (flags & INDEX_STAGE and paths and paths[-1] == path):
+            continue
+        paths.append(path)
+    # Расширения: подпись из четырёх байт и длина; в конце 20 байт контрольной суммы
+    while offset + 8 <= len(data) - 20:
+        signature, size = struct.unpack_from('>4sI', data, offset)
+        if signature in FALLBACK_EXTENSIONS:
+            return None
+        offset += 8 + size
+    return [os.fsdecode(path) for path in paths]
+
+
+def run_git(worktree, *args):
+    try:
+        result = subprocess.run(['git', '-C', worktree, *args], capture_output=True)
+    except FileNotFoundError:
+        raise GitError("git executable not found") from None
+    if result.returncode != 0:
+        message = result.stderr.decode('utf-8', 'replace').strip().splitlines()
+        raise GitError(message[-1] if message else f"git {args[0]} failed")
+    return [os.fsdecode(path) for path in result.stdout.split(b'\0') if path]
+
+
+def tracked_files(worktree, git_dir):
+    # Пути относительно корня рабочего дерева, через '/'
+    try:
+        with open(os.path.join(git_dir, 'index'), 'rb') as f:
+            paths = parse_index(f.read())
+    except FileNotFoundError:
+        # Репозиторий без единого git add
+        return []
+    except (OSError, struct.error, ValueError, IndexError):
+        paths = None
+    if paths is None:
+        lines = run_git(worktree, 'ls-files', '--stage', '-z')
+        paths = [line.split('\t', 1)[1] for line in lines if not line.startswith(f'{GITLINK_MODE:o} ')]
+        paths = list(dict.fromkeys(paths))
+    return paths
+
+
+def changed_files(worktree, ref):
+    # Отличающиеся от ref отслеживаемые файлы плюс неотслеживаемые, не попавшие в .gitignore
+    try:
+        run_git(worktree, 'rev-parse', '--verify', '--quiet', f'{ref}^{{commit}}')
+    except GitError:
+        raise GitError(f"Unknown revision: {ref}") from None
+    changed = run_git(worktree, 'diff', '--name-only', '--no-renames', '-z', ref, '--')
+    untracked = run_git(worktree, 'ls-files', '--others', '--exclude-standard', '-z')
+    return list(dict.fromkeys(changed + untracked))
+
+
+class GitWalker:
+    # Вместо обхода каталогов список файлов берётся из индекса git; выдаёт то же, что ParallelWalker
+    def __init__(self, matcher, repository, changed_since=None, threads=None, on_dir=None):
+        self.matcher = matcher
+        self.worktree, self.git_dir = repository
+        self.changed_since = changed_since
+        self.threads = threads or default_walker_threads()
+        # Как у ParallelWalker, но вызывается на каждый stat: обхода каталогов здесь нет
+        self.on_dir = on_dir
+
+    def rel_paths(self):
+        if self.changed_since:
+            paths = changed_files(self.worktree, self.changed_since)
+        else:
+            paths = tracked_files(self.worktree, self.git_dir)
+        prefix = os.path.relpath(os.path.abspath(self.matcher.folder_path), self.worktree)
+        prefix = '' if prefix == '.' else prefix.replace(os.sep, '/') + '/'
+        rel_paths = []
+        for path in paths:
+            if not path.startswith(prefix):
+                continue
+            rel_path = path[len(prefix):]
+            if os.sep != '/':
+                rel_path = rel_path.replace('/', os.sep)
+            rel_paths.append(rel_path)
+        return rel_paths
+
+    def stat_chunk(self, rel_paths):
+        folder_path = self.matcher.folder_path
+        entries = []
+        for rel_path in rel_paths:
+            file_path = os.path.join(folder_path, rel_path)
+            # Пользовательские шаблоны действуют и здесь, правила .gitignore к отслеживаемым файлам не применяются
+            if self.matcher.is_ignored(file_path, rel_path, False, ()):
+                continue
+            started = time.perf_counter()
+            try:
+                st = os.stat(file_path)
+                error = None
+            except FileNotFoundError:
+                # Удалён в рабочем дереве, но ещё есть в индексе или в diff
+                continue
+            except OSError as e:
+                st = None
+                error = e
+            if st is not None and stat.S_ISDIR(st.st_mode):
+                continue
+            rel_root, name = os.path.split(rel_path)
+            if self.on_dir is not None:
+                self.on_dir(rel_root, time.perf_counter() - started)
+            entries.append((os.path.join(folder_path, rel_root) if rel_root else folder_path, rel_root, name,
+                            st, error))
+        return entries
+
+    def __iter__(self):
+        rel_paths = self.rel_paths()
+        chunks = [rel_paths[i:i + STAT_CHUNK_SIZE] for i in range(0, len(rel_paths), STAT_CHUNK_SIZE)]
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+        try:
+            for entries in executor.map(self.stat_chunk, chunks):
+                yield from entries
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,187 @@
+import fnmatch
+import os
+import re
+
+IGNORE_FILES = ('.gitignore', '.ignore')
+# Каталоги, которые git никогда не индексирует
+ALWAYS_IGNORED_DIRS = ('.git',)
+
+
+def translate_gitignore(line):
+    line = line.rstrip('\n').rstrip('\r')
+    if not line.strip() or line.startswith('#'):
+        return None
+    if not line.endswith('\\ '):
+        line = line.rstrip(' ')
+    negate = line.startswith('!')
+    if negate:
+        line = line[1:]
+    elif line.startswith('\\'):
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    anchored = '/' in line
+    line = line.lstrip('/')
+
+    parts = []
+    i = 0
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if line.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif line.startswith('**', i) and i + 2 == n:
+            parts.append('.*')
+            i += 2
+        elif c == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif c == '?':
+            parts.append('[^/]')
+            i += 1
+        elif c == '[':
+            j = line.find(']', i + 2 if line[i + 1:i + 2] in ('!', ']') else i + 1)
+            if j == -1:
+                parts.append(re.escape(c))
+                i += 1
+            else:
+                body = line[i + 1:j].replace('\\', '\\\\')
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                parts.append(f'[{body}]')
+                i = j + 1
+        elif c == '\\' and i + 1 < n:
+            parts.append(re.escape(line[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(c))
+            i += 1
+    regex = ''.join(parts)
+    if not anchored:
+        regex = '(?:.*/)?' + regex
+    return regex, negate, dir_only
+
+
+class IgnoreFile:
+    def __init__(self, base, lines):
+        self.base = base
+        # Подряд идущие правила с одинаковыми флагами склеиваются в одно регулярное выражение
+        self.groups = []
+        for line in lines:
+            rule = translate_gitignore(line)
+            if rule is None:
+                continue
+            regex, negate, dir_only = rule
+            if self.groups and self.groups[-1][1:] == (negate, dir_only):
+                self.groups[-1][0].append(regex)
+            else:
+                self.groups.append(([regex], negate, dir_only))
+        self.groups = [(re.compile('^(?:' + '|'.join(regexes) + ')$', re.DOTALL), negate, dir_only)
+                       for regexes, negate, dir_only in self.groups]
+
+    @classmethod
+    def load(cls, path, base):
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                return cls(base, f.readlines())
+        except OSError:
+            return None
+
+    def match(self, rel_path, is_dir):
+        if self.base:
+            rel_path = rel_path[len(self.base) + 1:]
+        for regex, negate, dir_only in reversed(self.groups):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negate
+        return None
+
+
+class IgnoreMatcher:
+    def __init__(self, folder_path, patterns=None, use_ignore_files=True, excluded_paths=()):
+        self.folder_path = folder_path
+        self.use_ignore_files = use_ignore_files
+        # Файлы, которые не сканируются никогда (кеш самого сканера); храним пути относительно папки
+        self.excluded = set()
+        for path in excluded_paths:
+            self.exclude(path)
+        patterns = list(patterns or [])
+        flags = re.IGNORECASE if os.name == 'nt' else 0
+        self.file_regex = self.compile([fnmatch.translate(p) for p in patterns], flags)
+        # Каталог можно отсечь, только если шаблон заканчивается на '*':
+        # тогда он совпадёт и с любым путём внутри каталога
+        self.dir_regex = self.compile([fnmatch.translate(p) for p in patterns if p.endswith('*')], flags)
+        # Правила по каталогам для проверки отдельных путей вне обхода (режим наблюдения)
+        self.dir_rules = {}
+
+    @staticmethod
+    def compile(regexes, flags):
+        if not regexes:
+            return None
+        return re.compile('|'.join(f'(?:{r})' for r in regexes), flags)
+
+    def exclude(self, path):
+        rel_path = os.path.relpath(os.path.abspath(path), os.path.abspath(self.folder_path))
+        if rel_path != os.pardir and not rel_path.startswith(os.pardir + os.sep):
+            self.excluded.add(rel_path)
+
+    def is_ignored(self, full_path, rel_path, is_dir, rules):
+        if is_dir:
+            if self.use_ignore_files and os.path.basename(rel_path) in ALWAYS_IGNORED_DIRS:
+                return True
+            if self.dir_regex and (self.dir_regex.match(full_path + os.sep) or
+                                   self.dir_regex.match(rel_path + os.sep)):
+                return True
+        elif self.excluded and rel_path in self.excluded:
+            return True
+        elif self.file_regex and (self.file_regex.match(full_path) or self.file_regex.match(rel_path)):
+            return True
+        if rules:
+            git_path = rel_path.replace(os.sep, '/') if os.sep != '/' else rel_path
+            for rule in reversed(rules):
+                matched = rule.match(git_path, is_dir)
+                if matched is not None:
+                    return matched
+        return False
+
+    def reset_rules(self):
+        self.dir_rules.clear()
+
+    def rules_for(self, rel_dir):
+        # Правила, действующие внутри каталога ('' - корень), или None, если каталог игнорируется
+        if rel_dir in self.dir_rules:
+            return self.dir_rules[rel_dir]
+        root = os.path.join(self.folder_path, rel_dir) if rel_dir else self.folder_path
+        present = {name for name in IGNORE_FILES if os.path.isfile(os.path.join(root, name))}
+        if rel_dir:
+            parent_rules = self.rules_for(os.path.dirname(rel_dir))
+            if parent_rules is None or self.is_ignored(root, rel_dir, True, parent_rules):
+                rules = None
+            else:
+                rules = self.load_rules(root, rel_dir, present, parent_rules)
+        else:
+            rules = self.load_rules(root, '', present, ())
+        self.dir_rules[rel_dir] = rules
+        return rules
+
+    def is_path_ignored(self, rel_path, is_dir):
+        rules = self.rules_for(os.path.dirname(rel_path))
+        if rules is None:
+            return True
+        return self.is_ignored(os.path.join(self.folder_path, rel_path), rel_path, is_dir, rules)
+
+    def load_rules(self, root, rel_root, filenames, parent_rules):
+        if not self.use_ignore_files:
+            return parent_rules
+        rules = parent_rules
+        base = rel_root.replace(os.sep, '/') if os.sep != '/' else rel_root
+        for name in IGNORE_FILES:
+            if name in filenames:
+                ignore_file = IgnoreFile.load(os.path.join(root, name), base)
+                if ignore_file and ignore_file.groups:
+                    rules = rules + (ignore_file,)
+        return rules
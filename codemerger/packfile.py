@@ -0,0 +1,85 @@
+import struct
+
+# Файл: MAGIC, записи msgpack подряд, индекс {metadata, files: {путь: [смещение, длина]}}
+# и в конце смещение индекса вместе с MAGIC. По индексу любой файл читается одним seek
+MAGIC = b'CMPACK1\n'
+TRAILER = struct.Struct('<Q8s')
+
+
+def load_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError("msgpack export needs the msgpack package") from None
+    return msgpack
+
+
+class PackWriter:
+    def __init__(self, out):
+        self.msgpack = load_msgpack()
+        self.packer = self.msgpack.Packer(use_bin_type=True)
+        self.out = out
+        self.offset = 0
+        self.files = {}
+        self.write(MAGIC)
+
+    def write(self, data):
+        self.out.write(data)
+        self.offset += len(data)
+
+    def add(self, path, record):
+        data = self.packer.pack(record)
+        self.files[path] = (self.offset, len(data))
+        self.write(data)
+
+    def finish(self, metadata):
+        index_offset = self.offset
+        self.write(self.packer.pack({'metadata': metadata, 'files': self.files}))
+        self.write(TRAILER.pack(index_offset, MAGIC))
+
+
+class PackReader:
+    def __init__(self, path):
+        self.msgpack = load_msgpack()
+        self.f = open(path, 'rb')
+        try:
+            if self.f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a CodeMerger pack file: {path}")
+            trailer_offset = self.f.seek(-TRAILER.size, 2)
+            index_offset, magic = TRAILER.unpack(self.f.read(TRAILER.size))
+            if magic != MAGIC:
+                raise ValueError(f"Truncated CodeMerger pack file: {path}")
+            self.f.seek(index_offset)
+            index = self.msgpack.unpackb(self.f.read(trailer_offset - index_offset), raw=False)
+        except Exception:
+            self.f.close()
+            raise
+        self.metadata = index['metadata']
+        self.files = index['files']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __contains__(self, path):
+        return path in self.files
+
+    def close(self):
+        self.f.close()
+
+    def read(self, path):
+        offset, length = self.files[path]
+        self.f.seek(offset)
+        record = self.msgpack.unpackb(self.f.read(length), raw=False)
+        original = record.get('duplicate_of')
+        if original is not None and original in self.files:
+            record['content'] = self.read(original)['content']
+        return record
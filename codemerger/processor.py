@@ -0,0 +1,193 @@
+import codecs
+import functools
+import hashlib
+import os
+import time
+
+from binaryornot.helpers import is_binary_string
+
+from .encoding import DETECT_SAMPLE_SIZE, EncodingDetector
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Столько же байт читает binaryornot для определения бинарного файла
+HEAD_SIZE = 1024
+# При max_content_length читается не больше max_length * MAX_BYTES_PER_CHAR байт (столько занимает
+# самый длинный символ в UTF-8, UTF-16 и UTF-32) плюс запас на символ, разрезанный границей чтения
+MAX_BYTES_PER_CHAR = 4
+READ_MARGIN = 4
+TRUNCATED_MARKER = "\n[TRUNCATED]"
+TRUNCATE_MODES = ('head', 'head_tail')
+UTF8_ENCODINGS = ('ascii', 'utf-8', 'utf-8-sig')
+# Кодировки с единицей фиксированной длины: начало хвоста выравнивается по ней
+UNIT_SIZES = {'utf-16': 2, 'utf-16-le': 2, 'utf-16-be': 2, 'utf-32': 4, 'utf-32-le': 4, 'utf-32-be': 4}
+
+
+def content_hash(data):
+    # 63 бита, чтобы значение помещалось в INTEGER SQLite
+    if xxhash is not None:
+        return xxhash.xxh3_64_intdigest(data) >> 1
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big') >> 1
+
+
+def partial_hash(head, tail, size):
+    # Для частично прочитанного файла в хеш входит и размер: совпасть могут только начало и конец
+    return content_hash(b''.join((head, tail or b'', size.to_bytes(8, 'little'))))
+
+
+def utf8_end(data):
+    # Длина без последнего символа UTF-8, если граница чтения разрезала его
+    i = len(data) - 1
+    while i >= 0 and len(data) - i <= 4 and data[i] & 0xC0 == 0x80:
+        i -= 1
+    if i < 0 or data[i] < 0xC0:
+        return len(data)
+    needed = 2 if data[i] < 0xE0 else 3 if data[i] < 0xF0 else 4
+    return len(data) if len(data) - i >= needed else i
+
+
+def utf8_start(data):
+    # Пропускает продолжение символа UTF-8, начатого до точки чтения хвоста
+    i = 0
+    while i < min(len(data), 3) and data[i] & 0xC0 == 0x80:
+        i += 1
+    return i
+
+
+def codec_name(encoding):
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return encoding
+
+
+@functools.lru_cache(maxsize=None)
+def single_byte(encoding):
+    # Каждый байт - отдельный символ: с любого байта кодировка читается без сдвига
+    return len(bytes(range(256)).decode(encoding, errors='replace')) == 256
+
+
+def decode_head(data, encoding):
+    # Незаконченный символ в конце прочитанного инкрементальный декодер не выдаёт
+    return codecs.getincrementaldecoder(encoding)(errors='replace').decode(data, final=False)
+
+
+def decode_tail(data, encoding, head):
+    name = codec_name(encoding)
+    if name in UTF8_ENCODINGS:
+        return data[utf8_start(data):].decode('utf-8', errors='replace')
+    unit = UNIT_SIZES.get(name)
+    if unit:
+        if name in ('utf-16', 'utf-32'):
+            # Порядок байт задаёт BOM в начале файла, у хвоста его нет
+            bom = codecs.BOM_UTF16_BE if unit == 2 else codecs.BOM_UTF32_BE
+            name += '-be' if head.startswith(bom) else '-le'
+        # Конец файла выровнен по единице кодировки, значит и хвост должен быть кратен ей
+        return data[len(data) % unit:].decode(name, errors='replace')
+    if single_byte(name):
+        return data.decode(name, errors='replace')
+    # В многобайтовых кодировках хвост может начаться с середины символа. Перевод строки не бывает
+    # частью другого символа, после него чтение уже без сдвига; без него отбрасывается испорченный край
+    newline = data.find(b'\n')
+    if newline != -1:
+        return data[newline + 1:].decode(name, errors='replace')
+    return data.decode(name, errors='replace').lstrip('\ufffd')
+
+
+class FileProcessor:
+    # Объект передаётся в дочерние процессы, поэтому хранит только настройки
+    def __init__(self, max_content_length=None, max_file_size=None, excluded_files=None, encodings=None,
+                 timings=False, truncate_mode='head'):
+        self.max_content_length = max_content_length
+        # 'head' - начало файла, 'head_tail' - половина лимита с начала и половина с конца
+        self.truncate_mode = truncate_mode if truncate_mode in TRUNCATE_MODES else 'head'
+        self.max_file_size = max_file_size
+        self.excluded_files = set(excluded_files or [])
+        self.detector = EncodingDetector(encodings)
+        # Добавлять в результат время стадий: {'is_binary': с, 'read': с, ...}
+        self.timings = timings
+
+    def finish(self, result, **timings):
+        if self.timings:
+            result['timings'] = timings
+        return result
+
+    def read_limits(self, max_length):
+        # (байт с начала, байт с конца) для обрезанного содержимого. Начало не короче выборки
+        # charset_normalizer, чтобы кодировка определялась так же, как по целому файлу
+        tail_length = max_length // 2 if self.truncate_mode == 'head_tail' else 0
+        head_bytes = max((max_length - tail_length) * MAX_BYTES_PER_CHAR + READ_MARGIN, DETECT_SAMPLE_SIZE)
+        return head_bytes, tail_length * MAX_BYTES_PER_CHAR + READ_MARGIN if tail_length else 0
+
+    def truncate(self, content, tail, max_length):
+        # tail - отдельно прочитанный конец файла, None если файл прочитан целиком
+        if self.truncate_mode == 'head_tail':
+            tail_length = max_length // 2
+            if tail is None:
+                if len(content) <= max_length:
+                    return content
+                tail = content[len(content) - tail_length:]
+            tail = tail[len(tail) - tail_length:] if tail_length else ""
+            return content[:max_length - tail_length] + TRUNCATED_MARKER + "\n" + tail
+        if len(content) >= max_length:
+            return content[:max_length] + TRUNCATED_MARKER
+        return content
+
+    def process(self, file_path, rel_path, size):
+        max_length = self.max_content_length
+        if max_length and os.path.basename(file_path) in self.excluded_files:
+            max_length = None
+        try:
+            # Один open на файл: по первому блоку решаем, бинарный ли он,
+            # и дочитываем только текстовые файлы в пределах max_file_size и max_content_length
+            started = time.perf_counter()
+            with open(file_path, 'rb') as f:
+                head = f.read(HEAD_SIZE)
+                head_read = time.perf_counter()
+                binary = is_binary_string(head)
+                classified = time.perf_counter()
+                if binary:
+                    return self.finish({'status': 'BINARY', 'read': len(head)},
+                                       read=head_read - started, is_binary=classified - head_read)
+                if self.max_file_size and size > self.max_file_size:
+                    return self.finish({'status': 'SKIPPED', 'read': len(head)},
+                                       read=head_read - started, is_binary=classified - head_read)
+                head_bytes, tail_bytes = self.read_limits(max_length) if max_length else (None, 0)
+                tail_data = None
+                if head_bytes is None or head_bytes + tail_bytes >= size:
+                    raw_data = head + f.read()
+                else:
+                    raw_data = head + f.read(head_bytes - len(head))
+                    if tail_bytes:
+                        f.seek(-tail_bytes, os.SEEK_END)
+                        tail_data = f.read()
+            read = time.perf_counter()
+            partial = tail_data is not None or len(raw_data) < size
+            # Кодировка ещё неизвестна: обрезка по UTF-8 нужна, чтобы разрезанный символ не помешал её определить
+            data = raw_data[:utf8_end(raw_data)] if partial else raw_data
+            content, encoding, detect_time = self.detector.decode(data, rel_path)
+            if partial and codec_name(encoding) not in UTF8_ENCODINGS:
+                # Для других кодировок граница UTF-8 не годится: начало декодируется заново по их правилам
+                content = decode_head(raw_data, encoding)
+            tail = decode_tail(tail_data, encoding, raw_data) if tail_data is not None else None
+            decoded = time.perf_counter()
+            digest = partial_hash(raw_data, tail_data, size) if partial else content_hash(raw_data)
+            hashed = time.perf_counter()
+            if max_length:
+                content = self.truncate(content, tail, max_length)
+            bytes_read = len(raw_data) + len(tail_data or b'')
+            return self.finish(
+                {'status': 'OK', 'content': content, 'encoding': encoding, 'digest': digest, 'read': bytes_read},
+                read=(head_read - started) + (read - classified), is_binary=classified - head_read,
+                detect=detect_time, decode=decoded - read - detect_time, hash=hashed - decoded
+            )
+        except PermissionError:
+            return {'status': 'ACCESS_DENIED'}
+        except Exception as e:
+            return {'status': 'ERROR', 'error': str(e)}
+
+    def process_batch(self, batch):
+        return [self.process(file_path, rel_path, size) for file_path, rel_path, size in batch]
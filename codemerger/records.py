@@ -0,0 +1,125 @@
+import os
+import sys
+
+STATUSES = ('OK', 'ERROR', 'BINARY', 'SKIPPED', 'ACCESS_DENIED')
+NO_CONTENT = -1
+
+
+class FileRecord:
+    # Строковые поля (папка, расширение, статус, кодировка) интернированы и общие
+    # для всех записей, а содержимое лежит отдельно в RecordStore.contents
+    __slots__ = ('folder', 'name', 'extension', 'status', 'encoding', 'error', 'size', 'content_id', 'mtime',
+                 'mode', 'digest')
+
+    def __init__(self, folder, name, extension, status, encoding, error, size, content_id, mtime=None,
+                 mode=None, digest=None):
+        self.folder = folder
+        self.name = name
+        self.extension = extension
+        self.status = status
+        self.encoding = encoding
+        self.error = error
+        self.size = size
+        self.content_id = content_id
+        # size, mtime и mode берутся из stat, сделанного при обходе, повторно файл не stat'ится
+        self.mtime = mtime
+        self.mode = mode
+        # Хеш прочитанных байт файла, по нему экспорт находит одинаковое содержимое
+        self.digest = digest
+
+
+class RecordStore:
+    def __init__(self, root=''):
+        self.root = root
+        self.folders = {}
+        self.by_status = {status: [] for status in STATUSES}
+        self.contents = []
+        # Если содержимое не хранится в памяти, оно читается заново через loader(path, rel_path, size)
+        self.loader = None
+        # Необязательный полнотекстовый индекс (search.ContentIndex), пополняется в add()
+        self.index = None
+
+    def __len__(self):
+        return sum(len(files) for files in self.by_status.values())
+
+    def __iter__(self):
+        for files in self.folders.values():
+            yield from files
+
+    def __bool__(self):
+        return bool(self.folders)
+
+    def items(self):
+        return self.folders.items()
+
+    def values(self):
+        return self.folders.values()
+
+    def clear(self):
+        self.folders.clear()
+        for files in self.by_status.values():
+            files.clear()
+        self.contents.clear()
+        if self.index is not None:
+            self.index.clear()
+
+    def add(self, folder, name, extension, status, encoding=None, error=None, size=0, content=None, mtime=None,
+            mode=None, digest=None):
+        if content is None:
+            content_id = NO_CONTENT
+        else:
+            content_id = len(self.contents)
+            self.contents.append(content)
+        folder = sys.intern(folder)
+        record = FileRecord(folder, name, sys.intern(extension), sys.intern(status),
+                            sys.intern(encoding) if encoding else encoding, error, size, content_id, mtime,
+                            mode, digest)
+        files = self.folders.get(folder)
+        if files is None:
+            files = self.folders[folder] = []
+        files.append(record)
+        self.by_status.setdefault(record.status, []).append(record)
+        if self.index is not None and content is not None and record.status == 'OK':
+            self.index.add(record, content)
+        return record
+
+    def find(self, folder, name):
+        for record in self.folders.get(folder, ()):
+            if record.name == name:
+                return record
+        return None
+
+    def remove(self, records):
+        # Пачкой: каждый затронутый список перестраивается один раз
+        removed = set(records)
+        if not removed:
+            return
+        for folder in {record.folder for record in removed}:
+            files = [record for record in self.folders.get(folder, ()) if record not in removed]
+            if files:
+                self.folders[folder] = files
+            else:
+                self.folders.pop(folder, None)
+        for status in {record.status for record in removed}:
+            self.by_status[status] = [record for record in self.by_status[status] if record not in removed]
+        for record in removed:
+            if record.content_id != NO_CONTENT:
+                self.contents[record.content_id] = None
+        if self.index is not None:
+            self.index.remove(removed)
+
+    def counts(self):
+        return {status: len(files) for status, files in self.by_status.items()}
+
+    def rel_path(self, record):
+        return record.name if record.folder == '.' else os.path.join(record.folder, record.name)
+
+    def path(self, record):
+        return os.path.join(self.root, self.rel_path(record))
+
+    def content(self, record):
+        if record.content_id != NO_CONTENT:
+            return self.contents[record.content_id]
+        if record.status == 'OK' and self.loader is not None:
+            return self.loader(self.path(record), self.rel_path(record), record.size).get('content')
+        return "" if record.status == 'OK' else None
@@ -0,0 +1,406 @@
+import multiprocessing
+import os
+import queue
+import stat
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .config import BINARY_EXTENSIONS, MAX_CONTENT_LENGTH, MAX_FILE_SIZE
+from .gitindex import GitError, GitWalker, find_repository
+from .ignore import IgnoreMatcher
+from .processor import FileProcessor
+from .records import RecordStore
+from .search import ContentIndex
+from .walker import ParallelWalker
+
+ERROR_STATUSES = ('ERROR', 'ACCESS_DENIED')
+EXECUTORS = ('thread', 'process')
+# Размер пачки файлов на одну задачу пула
+CHUNK_SIZES = {'thread': 16, 'process': 128}
+
+
+def default_workers(executor):
+    if executor == 'process':
+        return os.cpu_count() or 4
+    return min(os.cpu_count() or 4, 8)
+
+
+class ScanProgress:
+    def __init__(self):
+        self.discovered = 0
+        self.processed = 0
+        self.errors = 0
+        self.bytes_read = 0
+        # Файлы, обрезанные по max_content_length без чтения целиком, и сколько байт не пришлось читать
+        self.partial_reads = 0
+        self.bytes_not_read = 0
+        # Файлы, содержимое которых уже встречалось, и их суммарный размер
+        self.duplicates = 0
+        self.duplicate_bytes = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.cancelled = False
+
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        # Пока обход не закончен, оценка по уже найденным файлам занижена
+        rate = self.rate()
+        if not rate:
+            return None
+        return max(self.discovered - self.processed, 0) / rate
+
+
+class Scanner:
+    def __init__(self, max_content_length=MAX_CONTENT_LENGTH, max_file_size=MAX_FILE_SIZE,
+                 excluded_files=None, ignore_patterns=None, cache=None, use_gitignore=True,
+                 walker_threads=None, encodings=None, executor='thread', workers=None, chunk_size=None,
+                 truncate_mode='head',
+                 keep_content=True, content_index=False, use_git_index=False, changed_since=None, stats=None,
+                 on_records=None):
+        self.max_content_length = max_content_length
+        self.truncate_mode = truncate_mode
+        self.max_file_size = max_file_size
+        self.excluded_files = set(excluded_files or [])
+        self.ignore_patterns = list(ignore_patterns or [])
+        self.use_gitignore = use_gitignore
+        self.walker_threads = walker_threads
+        self.encodings = dict(encodings or {})
+        self.executor = executor if executor in EXECUTORS else 'thread'
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.keep_content = keep_content
+        self.content_index = content_index
+        # Список файлов из индекса git вместо обхода; changed_since - только отличающиеся от коммита файлы
+        self.use_git_index = use_git_index
+        self.changed_since = changed_since
+        # Необязательная stats.ScanStats: задержки по стадиям и самые медленные файлы
+        self.stats = stats
+        # Вызывается из потока сканирования с пачкой только что добавленных записей
+        self.on_records = on_records
+        self.progress = ScanProgress()
+        self.cancelled = threading.Event()
+        self.cache = cache
+        self.structure = RecordStore()
+        self.cache_updates = []
+        self.digests = set()
+        self.lock = threading.Lock()
+        self.matcher = None
+        # Абсолютные пути, которые не сканируются (например, выгрузки демона внутри папки)
+        self.excluded_paths = set()
+        self.folder_path = ""
+
+    @classmethod
+    def from_config(cls, config, cache=None):
+        return cls(
+            max_content_length=config.get('max_content_length', MAX_CONTENT_LENGTH),
+            truncate_mode=config.get('truncate_mode', 'head'),
+            max_file_size=config.get('max_file_size', MAX_FILE_SIZE),
+            excluded_files=config.get('excluded_files', []),
+            ignore_patterns=config.get('ignore_patterns', []),
+            cache=cache,
+            use_gitignore=config.get('use_gitignore', True),
+            walker_threads=config.get('walker_threads'),
+            encodings=config.get('encodings', {}),
+            executor=config.get('executor', 'thread'),
+            workers=config.get('workers'),
+            chunk_size=config.get('chunk_size'),
+            keep_content=config.get('keep_content', True),
+            content_index=config.get('content_index', True),
+            use_git_index=config.get('use_git_index', False)
+        )
+
+    def cache_settings(self):
+        return {
+            'max_content_length': self.max_content_length,
+            'truncate_mode': self.truncate_mode,
+            'max_file_size': self.max_file_size,
+            'excluded_files': sorted(self.excluded_files),
+            'encodings': self.encodings,
+            'keep_content': self.keep_content
+        }
+
+    def scan(self, folder_path):
+        self.folder_path = folder_path
+        # Каждый скан получает новое хранилище: старое может ещё показываться в GUI
+        self.structure = RecordStore(folder_path)
+        if self.content_index and self.keep_content:
+            self.structure.index = ContentIndex()
+        self.cache_updates = []
+        self.digests = set()
+        self.progress = ScanProgress()
+        self.cancelled.clear()
+        if self.cache:
+            self.cache.open(self.cache_settings())
+        try:
+            return self.walk(folder_path)
+        finally:
+            self.progress.finished = time.monotonic()
+            if self.cache:
+                self.cache.close()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def make_processor(self):
+        return FileProcessor(
+            max_content_length=self.max_content_length,
+            truncate_mode=self.truncate_mode,
+            max_file_size=self.max_file_size,
+            excluded_files=self.excluded_files,
+            encodings=self.encodings,
+            timings=self.stats is not None
+        )
+
+    def make_matcher(self):
+        # Сохраняется после скана: по нему режим наблюдения проверяет отдельные пути
+        excluded_paths = list(self.excluded_paths)
+        if self.cache:
+            excluded_paths.extend(self.cache.files())
+        self.matcher = IgnoreMatcher(self.folder_path, self.ignore_patterns, self.use_gitignore, excluded_paths)
+        return self.matcher
+
+    def make_walker(self, matcher):
+        on_dir = self.stats.record_dir if self.stats is not None else None
+        if not self.use_git_index and not self.changed_since:
+            return ParallelWalker(matcher, self.walker_threads, on_dir=on_dir)
+        repository = find_repository(self.folder_path)
+        if repository is None:
+            if self.changed_since:
+                raise GitError(f"Not a git repository: {self.folder_path}")
+            # Папка вне репозитория сканируется обычным обходом
+            return ParallelWalker(matcher, self.walker_threads, on_dir=on_dir)
+        return GitWalker(matcher, repository, self.changed_since, self.walker_threads, on_dir=on_dir)
+
+    def make_executor(self):
+        workers = self.workers or default_workers(self.executor)
+        if self.executor == 'process':
+            # fork при живых потоках обхода небезопасен, поэтому всегда spawn
+            return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return ThreadPoolExecutor(max_workers=workers)
+
+    def walk(self, folder_path):
+        progress = self.progress
+        seen_paths = []
+        processor = self.make_processor()
+        self.structure.loader = processor.process
+        chunk_size = self.chunk_size or CHUNK_SIZES[self.executor]
+        executor = self.make_executor()
+        # Готовые пачки приходят через очередь и сливаются в этом же потоке, пока идёт обход
+        done = queue.Queue()
+        submitted = 0
+        merged = 0
+
+        def submit(batch, pending):
+            future = executor.submit(processor.process_batch, batch)
+            future.pending = pending
+            future.add_done_callback(done.put)
+
+        try:
+            batch = []
+            pending = []
+            matcher = self.make_matcher()
+            # Обход уже знает относительный путь и stat каждого файла, повторно их не вычисляем
+            for root, rel_root, file, st, error in self.make_walker(matcher):
+                if self.cancelled.is_set():
+                    break
+                file_path = os.path.join(root, file)
+                folder = rel_root or '.'
+                file_ext = os.path.splitext(file)[1].lower()
+                seen_paths.append(file_path)
+                progress.discovered += 1
+                if error is not None:
+                    status = 'ACCESS_DENIED' if isinstance(error, PermissionError) else 'ERROR'
+                    self.add_to_structure(file_path, folder, file, file_ext, status=status,
+                                          error=str(error) if status == 'ERROR' else None)
+                    continue
+                cached = self.cache.lookup(file_path, st) if self.cache else None
+                if cached:
+                    self.add_to_structure(file_path, folder, file, file_ext, st=st, store=False, **cached)
+                    continue
+                if file_ext in BINARY_EXTENSIONS:
+                    self.add_to_structure(file_path, folder, file, file_ext, st=st, status='BINARY')
+                    continue
+                batch.append((file_path, os.path.join(rel_root, file) if rel_root else file, st.st_size))
+                pending.append((file_path, folder, file, file_ext, st))
+                if len(batch) >= chunk_size:
+                    submit(batch, pending)
+                    submitted += 1
+                    batch = []
+                    pending = []
+                while not done.empty():
+                    self.merge_batch(done.get())
+                    merged += 1
+            if batch and not self.cancelled.is_set():
+                submit(batch, pending)
+                submitted += 1
+
+            while merged < submitted and not self.cancelled.is_set():
+                try:
+                    self.merge_batch(done.get(timeout=0.1))
+                    merged += 1
+                except queue.Empty:
+                    continue
+        finally:
+            cancelled = self.cancelled.is_set()
+            executor.shutdown(wait=not cancelled, cancel_futures=cancelled)
+
+        progress.cancelled = cancelled
+        if self.cache:
+            self.cache.store_many(folder_path, self.cache_updates)
+            # После отмены или при выборке изменённых файлов список неполный, удалять из кеша по нему нельзя
+            if not cancelled and not self.changed_since:
+                self.cache.prune(folder_path, seen_paths)
+            self.cache.enforce_limit()
+        return progress.processed, progress.errors
+
+    def merge_batch(self, future):
+        if future.cancelled():
+            return
+        records = []
+        stats = self.stats
+        progress = self.progress
+        for (file_path, folder, name, file_ext, st), result in zip(future.pending, future.result()):
+            read = result.pop('read', 0)
+            progress.bytes_read += read
+            if result['status'] == 'OK' and read < st.st_size:
+                progress.partial_reads += 1
+                progress.bytes_not_read += st.st_size - read
+            timings = result.pop('timings', None)
+            if timings and stats is not None:
+                stats.record_file(os.path.join(folder, name) if folder != '.' else name, timings, read)
+            records.append(self.make_record(file_path, folder, name, file_ext, st=st, **result))
+        self.add_records(records)
+
+    def make_record(self, file_path, folder, name, file_ext, st=None, store=True, status='OK', error=None,
+                    size=None, content=None, encoding=None, digest=None):
+        # st - единственный stat файла, сделанный при обходе; store=False для записей из кеша
+        if not self.keep_content:
+            content = None
+        elif content is None and status == 'OK':
+            content = ""
+        if encoding is None:
+            encoding = 'unknown' if status != 'OK' else None
+        fields = {
+            'folder': folder,
+            'name': name,
+            'extension': file_ext,
+            'status': status,
+            'encoding': encoding,
+            'error': error if error else None,
+            'size': st.st_size if st is not None else (size or 0),
+            'content': content,
+            'mtime': st.st_mtime if st is not None else None,
+            'mode': st.st_mode if st is not None else None,
+            'digest': digest
+        }
+        return fields, file_path, st if store else None
+
+    def update(self, paths):
+        # Обновляет записи после изменений на диске: пути - изменившиеся файлы или каталоги.
+        # Возвращает (удалённые, добавленные) записи
+        folder_path = self.folder_path
+        structure = self.structure
+        matcher = self.matcher or self.make_matcher()
+        rel_paths = set()
+        for path in paths:
+            rel_path = os.path.relpath(os.path.abspath(path), os.path.abspath(folder_path))
+            if rel_path != os.pardir and not rel_path.startswith(os.pardir + os.sep):
+                rel_paths.add(rel_path)
+        targets = []
+        for rel_path in sorted(rel_paths):
+            # Вложенные пути уже покрыты обновлением родительского каталога
+            parent = os.path.dirname(rel_path)
+            while parent and parent not in rel_paths:
+                parent = os.path.dirname(parent)
+            if (parent or '.') in rel_paths and rel_path != '.':
+                continue
+            targets.append((os.path.join(folder_path, rel_path) if rel_path != '.' else folder_path, rel_path))
+
+        removed = []
+        for path, rel_path in targets:
+            if rel_path == '.':
+                removed.extend(structure)
+                continue
+            folder, name = os.path.split(rel_path)
+            record = structure.find(folder or '.', name)
+            if record is not None:
+                removed.append(record)
+            prefix = rel_path + os.sep
+            for folder, files in structure.items():
+                if folder == rel_path or folder.startswith(prefix):
+                    removed.extend(files)
+        structure.remove(removed)
+
+        found = []
+        for path, rel_path in targets:
+            rel_path = '' if rel_path == '.' else rel_path
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                if os.path.islink(path):
+                    continue
+                parent_rules = matcher.rules_for(os.path.dirname(rel_path)) if rel_path else ()
+                if parent_rules is None or (rel_path and matcher.is_ignored(path, rel_path, True, parent_rules)):
+                    continue
+                walker = ParallelWalker(matcher, self.walker_threads, start=(path, rel_path, parent_rules))
+                found.extend(walker)
+            elif not matcher.is_path_ignored(rel_path, False):
+                rel_root, name = os.path.split(rel_path)
+                found.append((os.path.dirname(path), rel_root, name, st, None))
+
+        processor = self.make_processor()
+        records = []
+        for root, rel_root, name, st, error in found:
+            file_path = os.path.join(root, name)
+            folder = rel_root or '.'
+            file_ext = os.path.splitext(name)[1].lower()
+            if error is not None:
+                status = 'ACCESS_DENIED' if isinstance(error, PermissionError) else 'ERROR'
+                result = {'status': status, 'error': str(error) if status == 'ERROR' else None}
+            elif file_ext in BINARY_EXTENSIONS:
+                result = {'status': 'BINARY'}
+            else:
+                result = processor.process(file_path, os.path.join(rel_root, name) if rel_root else name, st.st_size)
+                result.pop('read', None)
+                result.pop('timings', None)
+            records.append(self.make_record(file_path, folder, name, file_ext, st=st, store=False, **result))
+        added = self.add_records(records, notify=False)
+        return removed, added
+
+    def add_records(self, records, notify=True):
+        added = []
+        progress = self.progress
+        waiting = time.perf_counter()
+        with self.lock:
+            if self.stats is not None:
+                self.stats.record('lock_wait', time.perf_counter() - waiting)
+            for fields, file_path, st in records:
+                added.append(self.structure.add(**fields))
+                if fields['status'] in ERROR_STATUSES:
+                    progress.errors += 1
+                digest = fields['digest']
+                if digest is not None:
+                    if digest in self.digests:
+                        progress.duplicates += 1
+                        progress.duplicate_bytes += fields['size']
+                    else:
+                        self.digests.add(digest)
+                if st is not None:
+                    self.cache_updates.append((file_path, st, fields['status'], fields['encoding'], fields['content'],
+                                               digest))
+            progress.processed += len(added)
+        if notify and self.on_records is not None:
+            self.on_records(added)
+        return added
+
+    def add_to_structure(self, file_path, folder, name, file_ext, **kwargs):
+        self.add_records([self.make_record(file_path, folder, name, file_ext, **kwargs)])
@@ -0,0 +1,347 @@
+import heapq
+import os
+import re
+from array import array
+from bisect import bisect_right
+
+# Если кандидатов меньше, дальше пересекать списки триграмм дороже, чем проверить файлы
+MIN_CANDIDATES = 64
+REGEX_SPECIAL = set('.^$*+?{}[]\\|()')
+# Сколько путей оценивается по одному; при большем числе кандидатов
+# остаются только те, где слова запроса встречаются целиком
+MAX_SCORED = 10000
+NAME_MATCH_LIMIT = 1000
+WORD_BOUNDARY = set('/_-. ')
+# Флаги внутри шаблона: (?x) меняет смысл пробелов, (?i) - регистра, буквальный фрагмент из них не выделить
+INLINE_FLAGS = re.compile(r'\(\?[aiLmsux-]')
+OCTAL_DIGITS = set('01234567')
+
+
+def trigrams(text):
+    return set(zip(text, text[1:], text[2:]))
+
+
+def escape_length(pattern, i):
+    # Длина экранированной последовательности, начинающейся с '\\' в позиции i
+    c = pattern[i + 1:i + 2]
+    if c == 'x':
+        return 4
+    if c == 'u':
+        return 6
+    if c == 'U':
+        return 10
+    if c == 'N':
+        j = pattern.find('}', i + 2)
+        return len(pattern) - i if j == -1 else j + 1 - i
+    if c == '0':
+        # \0 и ещё до двух восьмеричных цифр
+        n = 2
+        while n < 4 and i + n < len(pattern) and pattern[i + n] in OCTAL_DIGITS:
+            n += 1
+        return n
+    if c and c in '123456789':
+        # Три восьмеричные цифры - код символа, иначе ссылка на группу из одной или двух цифр
+        digits = pattern[i + 1:i + 4]
+        if len(digits) == 3 and set(digits) <= OCTAL_DIGITS:
+            return 4
+        return 3 if pattern[i + 2:i + 3].isdigit() else 2
+    return 2
+
+
+def literal_from_regex(pattern):
+    # Самый длинный фрагмент без спецсимволов вне групп и классов символов,
+    # который обязан быть в любом совпадении. При альтернативе такого фрагмента нет
+    if '|' in pattern or INLINE_FLAGS.search(pattern):
+        return ''
+    best = ''
+    current = []
+    depth = 0
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if depth == 0 and c not in REGEX_SPECIAL:
+            current.append(c)
+            i += 1
+            continue
+        # Квантификатор делает предыдущий символ необязательным
+        if c in '*?{' and current:
+            current.pop()
+        if len(current) > len(best):
+            best = ''.join(current)
+        current = []
+        if c == '\\':
+            # Любая экранированная последовательность обрывает фрагмент: \x70 - это 'p', а не текст 'x70'
+            i += escape_length(pattern, i)
+        elif c == '[':
+            j = pattern.find(']', i + 2)
+            i = n if j == -1 else j + 1
+        elif c == '{':
+            # Числа в {m,n} - часть квантификатора, а не текст
+            j = pattern.find('}', i + 1)
+            i = n if j == -1 else j + 1
+        elif c == '(':
+            depth += 1
+            i += 1
+        elif c == ')':
+            depth = max(depth - 1, 0)
+            i += 1
+        else:
+            i += 1
+    if len(current) > len(best):
+        best = ''.join(current)
+    return best
+
+
+class SearchHit:
+    __slots__ = ('record', 'line_no', 'line')
+
+    def __init__(self, record, line_no, line):
+        self.record = record
+        self.line_no = line_no
+        self.line = line
+
+
+class ContentIndex:
+    def __init__(self):
+        self.docs = []
+        self.postings = {}
+        self.removed = 0
+
+    def __len__(self):
+        return len(self.docs) - self.removed
+
+    def clear(self):
+        self.docs.clear()
+        self.postings.clear()
+        self.removed = 0
+
+    def remove(self, records):
+        # Списки триграмм не чистятся: удалённый документ просто пропускается при поиске
+        for doc_id, record in enumerate(self.docs):
+            if record is not None and record in records:
+                self.docs[doc_id] = None
+                self.removed += 1
+
+    def add(self, record, content):
+        doc_id = len(self.docs)
+        self.docs.append(record)
+        postings = self.postings
+        for trigram in trigrams(content.lower()):
+            ids = postings.get(trigram)
+            if ids is None:
+                ids = postings[trigram] = array('I')
+            ids.append(doc_id)
+
+    def candidates(self, literal):
+        grams = trigrams(literal.lower())
+        if not grams:
+            return [record for record in self.docs if record is not None]
+        lists = []
+        for trigram in grams:
+            ids = self.postings.get(trigram)
+            if not ids:
+                return []
+            lists.append(ids)
+        lists.sort(key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            if len(result) <= MIN_CANDIDATES:
+                break
+            result.intersection_update(ids)
+        docs = self.docs
+        return [docs[doc_id] for doc_id in sorted(result) if docs[doc_id] is not None]
+
+
+def fuzzy_score(term, path):
+    # Совпадение ищется справа налево, чтобы оно тянулось к имени файла, а не к каталогам
+    name_start = path.rfind('/') + 1
+    pos = path.rfind(term)
+    if pos != -1:
+        positions = range(pos, pos + len(term))
+    else:
+        positions = []
+        i = len(path)
+        for c in reversed(term):
+            i = path.rfind(c, 0, i)
+            if i == -1:
+                return None
+            positions.append(i)
+        positions.reverse()
+    score = 0
+    prev = -2
+    for p in positions:
+        score += 16 if p >= name_start else 8
+        if p == prev + 1:
+            score += 8
+        if p == 0 or path[p - 1] in WORD_BOUNDARY:
+            score += 10
+        prev = p
+    return score
+
+
+def fuzzy_pattern(term):
+    # Между символами запроса стоит класс без следующего символа, поэтому шаблон
+    # не откатывается и находит самое левое вхождение подпоследовательности
+    body = re.escape(term[0])
+    for c in term[1:]:
+        body += f'[^{re.escape(c)}\n]*' + re.escape(c)
+    return body
+
+
+class NameIndex:
+    # Пути в нижнем регистре склеены через '\n' в одну строку: первичный отбор
+    # делает одно регулярное выражение, а не цикл Python по всем записям
+    def __init__(self):
+        self.records = []
+        self.parts = []
+        self.lengths = array('I')
+        self.starts = array('Q')
+        self.size = 0
+        self.text = ''
+        self.removed = 0
+        # Кандидаты прошлого запроса: пока запрос дописывается, ищем только среди них
+        self.last_terms = None
+        self.last_ids = None
+
+    def __len__(self):
+        return len(self.records) - self.removed
+
+    def clear(self):
+        self.records.clear()
+        self.parts.clear()
+        self.lengths = array('I')
+        self.starts = array('Q')
+        self.size = 0
+        self.text = ''
+        self.removed = 0
+        self.last_terms = self.last_ids = None
+
+    def remove(self, records):
+        # Путь остаётся в общей строке, чтобы не сдвигать смещения; запись из выдачи пропадает
+        records = set(records)
+        for i, record in enumerate(self.records):
+            if record is not None and record in records:
+                self.records[i] = None
+                self.removed += 1
+        self.last_terms = self.last_ids = None
+
+    def add(self, record, rel_path):
+        path = rel_path.lower()
+        if os.sep != '/':
+            path = path.replace(os.sep, '/')
+        path = path.replace('\n', ' ')
+        self.records.append(record)
+        self.parts.append(path)
+        self.lengths.append(len(path))
+        self.starts.append(self.size)
+        self.size += len(path) + 1
+        self.last_terms = self.last_ids = None
+
+    def add_records(self, structure, records):
+        for record in records:
+            self.add(record, structure.rel_path(record))
+
+    def joined(self):
+        if len(self.text) != self.size:
+            self.text = '\n'.join(self.parts) + '\n'
+        return self.text
+
+    def narrows(self, terms):
+        last = self.last_terms
+        return (last is not None and len(terms) >= len(last) and
+                all(term.startswith(prev) for term, prev in zip(terms, last)))
+
+    def match_ids(self, terms):
+        parts = self.parts
+        # Если прошлых кандидатов больше половины, одно регулярное выражение по всей строке быстрее
+        if self.narrows(terms) and len(self.last_ids) < len(parts) // 2:
+            doc_ids = self.last_ids
+            for term in terms:
+                search = re.compile(fuzzy_pattern(term)).search
+                doc_ids = [i for i in doc_ids if search(parts[i])]
+            return doc_ids
+        text = self.joined()
+        starts = self.starts
+        doc_ids = None
+        for term in terms:
+            if len(term) == 1:
+                # Один символ встречается почти везде: проверка вхождения дешевле поиска строки по смещению
+                found = {i for i, part in enumerate(parts) if term in part}
+            else:
+                # Хвост дочитывает строку, чтобы каждый путь попал в выдачу один раз
+                pattern = re.compile(fuzzy_pattern(term) + '[^\n]*')
+                found = {bisect_right(starts, m.start()) - 1 for m in pattern.finditer(text)}
+            doc_ids = found if doc_ids is None else doc_ids & found
+            if not doc_ids:
+                break
+        return sorted(doc_ids)
+
+    def search(self, query, limit=NAME_MATCH_LIMIT):
+        terms = query.lower().split()
+        if not terms or not self.records:
+            return []
+        doc_ids = self.match_ids(terms)
+        self.last_terms = terms
+        self.last_ids = doc_ids
+
+        parts = self.parts
+        if len(doc_ids) > MAX_SCORED:
+            literal_ids = doc_ids
+            for term in terms:
+                if len(term) > 1:
+                    literal_ids = [i for i in literal_ids if term in parts[i]]
+            doc_ids = literal_ids or doc_ids
+            if len(doc_ids) > MAX_SCORED:
+                doc_ids = sorted(doc_ids, key=self.lengths.__getitem__)[:MAX_SCORED]
+
+        records = self.records
+        scored = []
+        for i in doc_ids:
+            if records[i] is None:
+                continue
+            path = parts[i]
+            score = 0
+            for term in terms:
+                term_score = fuzzy_score(term, path)
+                if term_score is None:
+                    break
+                score += term_score
+            else:
+                scored.append((score, -len(path), -i))
+        return [records[-i] for score, length, i in heapq.nlargest(limit, scored)]
+
+
+def compile_query(query, regex=False, case_sensitive=False):
+    flags = 0 if case_sensitive else re.IGNORECASE
+    return re.compile(query if regex else re.escape(query), flags)
+
+
+def search_content(structure, query, regex=False, case_sensitive=False, limit=None):
+    pattern = compile_query(query, regex, case_sensitive)
+    literal = literal_from_regex(query) if regex else query
+    index = getattr(structure, 'index', None)
+    if index is not None and len(index) == len(structure.by_status['OK']):
+        records = index.candidates(literal)
+    else:
+        records = structure.by_status['OK']
+
+    # В регулярном выражении регистр может меняться флагами внутри шаблона
+    exact = case_sensitive and not regex
+    needle = literal if exact else literal.lower()
+    hits = []
+    for record in records:
+        content = structure.content(record)
+        if not content:
+            continue
+        # Быстрая проверка целиком по файлу, прежде чем делить его на строки
+        if needle and needle not in (content if exact else content.lower()):
+            continue
+        if regex and not pattern.search(content):
+            continue
+        for line_no, line in enumerate(content.split('\n'), 1):
+            if pattern.search(line):
+                hits.append(SearchHit(record, line_no, line))
+                if limit and len(hits) >= limit:
+                    return hits
+    return hits
@@ -0,0 +1,138 @@
+import contextlib
+import heapq
+import json
+import os
+import threading
+import time
+
+STAGES = ('enumerate', 'is_binary', 'read', 'detect', 'decode', 'hash', 'lock_wait', 'export')
+SLOWEST_LIMIT = 20
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+    # Корзины по степеням двойки в микросекундах: корзина k - задержки меньше 2**k мкс
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, fraction):
+        # Верхняя граница корзины, в которую попал процентиль, но не больше максимума
+        target = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def as_dict(self):
+        result = {
+            'count': self.count,
+            'total_s': round(self.total, 6),
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else None,
+            'max_ms': round(self.max * 1000, 3)
+        }
+        for fraction in PERCENTILES:
+            result[f'p{round(fraction * 100)}_ms'] = round(self.percentile(fraction) * 1000, 3) if self.count else None
+        result['buckets_us'] = {f'<{1 << bucket}': self.buckets[bucket] for bucket in sorted(self.buckets)}
+        return result
+
+
+class ScanStats:
+    # Пишется из потоков обхода и главного потока скана, поэтому под своей блокировкой
+    def __init__(self, slowest_limit=SLOWEST_LIMIT):
+        self.slowest_limit = slowest_limit
+        self.stages = {stage: Histogram() for stage in STAGES}
+        # Куча (секунды, путь, разбивка по стадиям) самых медленных файлов
+        self.slowest = []
+        self.dirs = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.stages[stage].add(seconds)
+
+    def record_dir(self, rel_dir, seconds):
+        with self.lock:
+            self.stages['enumerate'].add(seconds)
+            self.dirs[rel_dir] = self.dirs.get(rel_dir, 0.0) + seconds
+
+    def record_file(self, rel_path, timings, bytes_read=None):
+        total = sum(timings.values())
+        rel_dir = os.path.dirname(rel_path)
+        with self.lock:
+            for stage, seconds in timings.items():
+                # Ноль - стадия не выполнялась, например определение кодировки для UTF-8
+                if seconds:
+                    self.stages[stage].add(seconds)
+            self.dirs[rel_dir] = self.dirs.get(rel_dir, 0.0) + total
+            item = (total, rel_path, timings, bytes_read)
+            if len(self.slowest) < self.slowest_limit:
+                heapq.heappush(self.slowest, item)
+            elif total > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, item)
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def slowest_files(self):
+        with self.lock:
+            items = sorted(self.slowest, key=lambda item: item[0], reverse=True)
+        return [{'path': path, 'ms': round(total * 1000, 3), 'bytes_read': bytes_read,
+                 'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}}
+                for total, path, timings, bytes_read in items]
+
+    def slowest_dirs(self):
+        # Время каталога - его обход плюс обработка файлов прямо в нём
+        with self.lock:
+            items = heapq.nlargest(self.slowest_limit, self.dirs.items(), key=lambda item: item[1])
+        return [{'path': rel_dir or '.', 'ms': round(seconds * 1000, 3)} for rel_dir, seconds in items]
+
+    def as_dict(self):
+        with self.lock:
+            stages = {stage: histogram.as_dict() for stage, histogram in self.stages.items() if histogram.count}
+        return {
+            'stages': stages,
+            'slowest_files': self.slowest_files(),
+            'slowest_dirs': self.slowest_dirs()
+        }
+
+    def summary(self, top=5):
+        lines = []
+        with self.lock:
+            histograms = [(stage, histogram) for stage, histogram in self.stages.items() if histogram.count]
+        for stage, histogram in histograms:
+            lines.append(f"{stage:10} {histogram.count:8} calls {histogram.total:9.3f}s total "
+                         f"p50 {histogram.percentile(0.5) * 1000:8.3f}ms p99 {histogram.percentile(0.99) * 1000:8.3f}ms "
+                         f"max {histogram.max * 1000:8.3f}ms")
+        for item in self.slowest_files()[:top]:
+            read_note = f" ({item['bytes_read'] // 1024} kb read)" if item['bytes_read'] is not None else ""
+            lines.append(f"slow file  {item['ms']:9.1f}ms {item['path']}{read_note}")
+        for item in self.slowest_dirs()[:top]:
+            lines.append(f"slow dir   {item['ms']:9.1f}ms {item['path']}")
+        return lines
+
+    def write_trace(self, path, **extra):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(dict(extra, **self.as_dict()), f, ensure_ascii=False, indent=2)
+
+
+def timed(stats, stage):
+    # Замер стадии, если статистика включена
+    return stats.time(stage) if stats is not None else contextlib.nullcontext()
@@ -0,0 +1,190 @@
+import codecs
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+
+from .search import compile_query
+
+# Индекс строк разреженный: на каждый блок хранится число переводов строки до его начала
+BLOCK_SIZE = 64 * 1024
+# Длиннее строки при показе обрезаются, чтобы минифицированный файл не повесил виджет
+MAX_LINE_LENGTH = 10000
+# Сколько данных декодируется за раз при поиске регулярным выражением или без учёта регистра
+SEARCH_WINDOW = 1024 * 1024
+LONG_LINE_MARKER = ' …'
+
+
+def mappable_encoding(encoding):
+    # Кодировка, в которой байт '\n' встречается только как перевод строки, и длина BOM
+    if not encoding:
+        return None, 0
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return None, 0
+    if name == 'ascii':
+        # Файл мог измениться после сканирования, UTF-8 прочитает и ASCII
+        return 'utf-8', 0
+    if name == 'utf-8-sig':
+        return 'utf-8', len(codecs.BOM_UTF8)
+    try:
+        if '\n'.encode(name) != b'\n':
+            return None, 0
+    except (UnicodeError, LookupError):
+        return None, 0
+    return name, 0
+
+
+class TextDocument:
+    # Текст по строкам без загрузки целиком: data - mmap файла или строка с содержимым
+    def __init__(self, data, encoding=None, start=0, source=None):
+        self.data = data
+        self.encoding = encoding
+        self.newline = b'\n' if encoding else '\n'
+        self.start = start
+        self.end = len(data)
+        self.source = source
+        self.blocks = array('q')
+        self.index()
+
+    @classmethod
+    def from_file(cls, path, encoding):
+        encoding, bom = mappable_encoding(encoding)
+        if encoding is None:
+            return None
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size <= bom:
+                return None
+            # Отображение живёт отдельно от дескриптора. Файл, укороченный другим процессом,
+            # пока окно открыто, на POSIX даёт SIGBUS при чтении за новым концом
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if bom and data[:bom] != codecs.BOM_UTF8:
+            bom = 0
+        return cls(data, encoding, bom, path)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def index(self):
+        data = self.data
+        newline = self.newline
+        blocks = self.blocks
+        lines = 0
+        for pos in range(self.start, self.end, BLOCK_SIZE):
+            blocks.append(lines)
+            lines += data[pos:pos + BLOCK_SIZE].count(newline)
+        blocks.append(lines)
+        self.line_count = lines + 1
+
+    def decode(self, chunk):
+        return chunk.decode(self.encoding, 'replace') if self.encoding else chunk
+
+    def line_start(self, line):
+        # Смещение начала строки line (с нуля): ищется блок с нужным переводом строки, дальше find
+        if line <= 0:
+            return self.start
+        if line >= self.line_count:
+            return self.end
+        block = bisect_left(self.blocks, line) - 1
+        pos = self.start + block * BLOCK_SIZE
+        data = self.data
+        newline = self.newline
+        for _ in range(line - self.blocks[block]):
+            pos = data.find(newline, pos, self.end) + 1
+        return pos
+
+    def line_of(self, offset):
+        # Номер строки (с нуля), в которой лежит смещение
+        block = (offset - self.start) // BLOCK_SIZE
+        block_start = self.start + block * BLOCK_SIZE
+        return self.blocks[block] + self.data[block_start:offset].count(self.newline)
+
+    def lines(self, first, count):
+        data = self.data
+        newline = self.newline
+        pos = self.line_start(first)
+        result = []
+        for _ in range(min(count, self.line_count - first)):
+            end = data.find(newline, pos, self.end)
+            if end == -1:
+                end = self.end
+            line = self.decode(data[pos:min(end, pos + MAX_LINE_LENGTH)])
+            if end - pos > MAX_LINE_LENGTH:
+                line += LONG_LINE_MARKER
+            result.append(line.rstrip('\r'))
+            pos = end + 1
+        return result
+
+    def find(self, query, first_line=0, regex=False, case_sensitive=False):
+        # (строка, столбец, длина) первого совпадения не раньше first_line или None; re.error пробрасывается
+        pattern = compile_query(query, regex, case_sensitive)
+        pos = self.line_start(first_line)
+        data = self.data
+        if not regex and case_sensitive:
+            # Точная строка ищется прямо в байтах, без декодирования
+            try:
+                needle = query.encode(self.encoding) if self.encoding else query
+            except UnicodeEncodeError:
+                # Символа нет в кодировке файла - значит, нет и совпадения
+                return None
+            found = data.find(needle, pos, self.end)
+            return self.position(found) + (len(query),) if found != -1 else None
+        # Без учёта регистра строка сначала ищется в тексте в нижнем регистре: это в разы быстрее re.IGNORECASE,
+        # а найденная строка проверяется самим шаблоном
+        needle = None if regex else query.lower()
+        while pos < self.end:
+            # Окно заканчивается на переводе строки, чтобы не разрезать символ и строку
+            end = data.find(self.newline, min(pos + SEARCH_WINDOW, self.end), self.end)
+            end = self.end if end == -1 else end + 1
+            text = self.decode(data[pos:end])
+            if needle is not None:
+                lowered = text.lower()
+                line = self.line_of(pos)
+                counted = 0
+                found = lowered.find(needle)
+                while found != -1:
+                    line += lowered.count('\n', counted, found)
+                    counted = found
+                    match = pattern.search(self.line_text(line))
+                    if match:
+                        return line, match.start(), match.end() - match.start()
+                    next_line = lowered.find('\n', found)
+                    if next_line == -1:
+                        break
+                    found = lowered.find(needle, next_line + 1)
+                pos = end
+                continue
+            match = pattern.search(text)
+            if match:
+                line = self.line_of(pos) + text.count('\n', 0, match.start())
+                return (line, match.start() - text.rfind('\n', 0, match.start()) - 1,
+                        match.end() - match.start())
+            pos = end
+        return None
+
+    def line_text(self, line):
+        start = self.line_start(line)
+        end = self.data.find(self.newline, start, self.end)
+        return self.decode(self.data[start:self.end if end == -1 else end])
+
+    def position(self, offset):
+        line = self.line_of(offset)
+        return line, len(self.decode(self.data[self.line_start(line):offset]))
+
+
+def open_document(structure, record):
+    # Файл отображается в память, если его кодировка это позволяет; иначе берётся содержимое из скана
+    if record.status != 'OK':
+        return None
+    try:
+        document = TextDocument.from_file(structure.path(record), record.encoding)
+    except (OSError, ValueError):
+        document = None
+    if document is None:
+        content = structure.content(record)
+        if not content:
+            return None
+        document = TextDocument(content)
+    return document
@@ -0,0 +1,114 @@
+import os
+import queue
+import threading
+import time
+
+QUEUE_SIZE = 4096
+DONE = object()
+
+
+def default_walker_threads():
+    # Обход упирается в ввод-вывод, поэтому потоков больше, чем ядер
+    return min(32, (os.cpu_count() or 4) + 4)
+
+
+class ParallelWalker:
+    def __init__(self, matcher, threads=None, queue_size=QUEUE_SIZE, start=None, on_dir=None):
+        self.matcher = matcher
+        # (каталог, путь относительно корня, правила родительского каталога); по умолчанию корень
+        self.start = start or (matcher.folder_path, '', ())
+        self.threads = threads or default_walker_threads()
+        # on_dir(путь каталога, секунды) вызывается из потоков обхода после чтения каждого каталога
+        self.on_dir = on_dir
+        self.entries = queue.Queue(maxsize=queue_size)
+        self.dirs = queue.Queue()
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def __iter__(self):
+        self.pending = 1
+        self.dirs.put(self.start)
+        workers = [threading.Thread(target=self.work, daemon=True) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        try:
+            while True:
+                item = self.entries.get()
+                if item is DONE:
+                    break
+                yield item
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stopped.set()
+        for _ in range(self.threads):
+            self.dirs.put(None)
+
+    def emit(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.entries.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work(self):
+        while True:
+            job = self.dirs.get()
+            if job is None:
+                return
+            try:
+                if not self.stopped.is_set():
+                    self.scan_dir(*job)
+            finally:
+                with self.lock:
+                    self.pending -= 1
+                    finished = self.pending == 0
+                if finished:
+                    self.emit(DONE)
+
+    def scan_dir(self, root, rel_root, parent_rules):
+        started = time.perf_counter()
+        try:
+            with os.scandir(root) as it:
+                entries = list(it)
+        except OSError:
+            return
+        matcher = self.matcher
+        rules = matcher.load_rules(root, rel_root, {entry.name for entry in entries}, parent_rules)
+        prefix = rel_root + os.sep if rel_root else ''
+        # Файлы каталога отдаются после замера, чтобы ожидание в полной очереди не попало в его время
+        files = []
+        for entry in entries:
+            if self.stopped.is_set():
+                return
+            rel_path = prefix + entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                # Как и os.walk, по символическим ссылкам на каталоги не ходим
+                if entry.is_symlink() or matcher.is_ignored(entry.path, rel_path, True, rules):
+                    continue
+                with self.lock:
+                    self.pending += 1
+                self.dirs.put((entry.path, rel_path, rules))
+                continue
+            if matcher.is_ignored(entry.path, rel_path, False, rules):
+                continue
+            try:
+                st = entry.stat()
+                error = None
+            except OSError as e:
+                st = None
+                error = e
+            files.append((root, rel_root, entry.name, st, error))
+        if self.on_dir is not None:
+            self.on_dir(rel_root, time.perf_counter() - started)
+        for item in files:
+            if not self.emit(item):
+                return
@@ -0,0 +1,255 @@
+import contextlib
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from .exporters import export_file
+from .ignore import IGNORE_FILES
+from .walker import ParallelWalker
+
+# Пауза без событий, после которой изменения применяются пачкой, с
+DEBOUNCE = 0.5
+POLL_INTERVAL = 2.0
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    # Linux inotify через ctypes: по дескриптору на каталог, игнорируемые каталоги не отслеживаются
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.folder_path = matcher.folder_path
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        try:
+            self.watch_tree(self.folder_path)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def rel_path(self, path):
+        rel_path = os.path.relpath(path, self.folder_path)
+        return '' if rel_path == '.' else rel_path
+
+    def watch_tree(self, path):
+        rel_path = self.rel_path(path)
+        if self.matcher.rules_for(rel_path) is None:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            # Каталог мог исчезнуть между событием и добавлением наблюдения
+            if path != self.folder_path and errno in (2, 20):
+                return
+            raise OSError(errno, f"inotify_add_watch failed for {path}: {os.strerror(errno)}")
+        self.dirs[wd] = path
+        try:
+            with os.scandir(path) as it:
+                subdirs = [entry.path for entry in it if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            return
+        for subdir in subdirs:
+            self.watch_tree(subdir)
+
+    def rewatch(self, path):
+        if os.path.isdir(path):
+            self.watch_tree(path)
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+                offset += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # События потеряны: обновляем всё дерево
+                    changed.add(self.folder_path)
+                    continue
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                root = self.dirs.get(wd)
+                if root is None or not name:
+                    continue
+                path = os.path.join(root, os.fsdecode(name))
+                is_dir = bool(mask & IN_ISDIR)
+                if self.matcher.is_path_ignored(self.rel_path(path), is_dir):
+                    continue
+                if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.watch_tree(path)
+                    except OSError:
+                        # Лимит наблюдений исчерпан: сам каталог всё равно будет просканирован
+                        pass
+                changed.add(path)
+        return changed
+
+
+class PollingWatcher:
+    # Запасной вариант: периодический обход с сравнением (размер, mtime, inode)
+    def __init__(self, matcher, interval=POLL_INTERVAL, threads=None):
+        self.matcher = matcher
+        self.interval = interval
+        self.threads = threads
+        self.snapshot = self.take_snapshot()
+        self.next_poll = time.monotonic() + interval
+
+    def close(self):
+        pass
+
+    def rewatch(self, path):
+        pass
+
+    def take_snapshot(self):
+        snapshot = {}
+        for root, rel_root, name, st, error in ParallelWalker(self.matcher, self.threads):
+            key = (st.st_size, st.st_mtime_ns, st.st_ino) if st is not None else None
+            snapshot[os.path.join(root, name)] = key
+        return snapshot
+
+    def read(self, timeout):
+        delay = self.next_poll - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            if time.monotonic() < self.next_poll:
+                return set()
+        # Правила .gitignore перечитываются на каждом проходе
+        self.matcher.reset_rules()
+        snapshot = self.take_snapshot()
+        self.next_poll = time.monotonic() + self.interval
+        old = self.snapshot
+        self.snapshot = snapshot
+        changed = {path for path, key in snapshot.items() if old.get(path, False) != key}
+        changed.update(path for path in old if path not in snapshot)
+        return changed
+
+
+def make_watcher(matcher, poll=False, interval=POLL_INTERVAL, threads=None):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(matcher)
+        except (OSError, AttributeError):
+            # Нет inotify или кончился лимит наблюдений (fs.inotify.max_user_watches)
+            pass
+    return PollingWatcher(matcher, interval, threads)
+
+
+def rewrite_export(structure, folder_path, file_path, fmt, dedupe=True):
+    # Пишем рядом и подменяем файл целиком, чтобы читатели не видели половину выгрузки
+    tmp_path = f"{file_path}.tmp"
+    export_file(structure, folder_path, tmp_path, fmt, dedupe)
+    os.replace(tmp_path, file_path)
+
+
+def exclude_export(scanner, file_path):
+    # Выгрузка внутри наблюдаемой папки не сканируется: иначе каждая её перезапись вызывала бы
+    # новое обновление, а следующая выгрузка включала бы предыдущую
+    for path in (file_path, f"{file_path}.tmp"):
+        path = os.path.abspath(path)
+        scanner.excluded_paths.add(path)
+        if scanner.matcher is not None:
+            scanner.matcher.exclude(path)
+
+
+class WatchSession:
+    def __init__(self, scanner, debounce=DEBOUNCE, poll=False, interval=POLL_INTERVAL, export_path=None,
+                 export_format='md', dedupe=True, on_update=None, lock=None):
+        self.scanner = scanner
+        self.debounce = debounce
+        self.poll = poll
+        self.interval = interval
+        self.export_path = None
+        self.export_format = export_format
+        self.set_export(export_path, export_format)
+        self.dedupe = dedupe
+        # Вызывается из потока наблюдения с удалёнными и добавленными записями
+        self.on_update = on_update
+        # Обновление записей и on_update идут под lock, если она задана: читатели из других потоков
+        # не видят структуру наполовину обновлённой
+        self.lock = lock or contextlib.nullcontext()
+        self.stopped = threading.Event()
+        self.watcher = None
+
+    def set_export(self, export_path, export_format='md'):
+        if export_path:
+            exclude_export(self.scanner, export_path)
+        self.export_path = export_path
+        self.export_format = export_format
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        scanner = self.scanner
+        matcher = scanner.matcher or scanner.make_matcher()
+        self.watcher = make_watcher(matcher, self.poll, self.interval, scanner.walker_threads)
+        pending = set()
+        last_event = 0.0
+        try:
+            while not self.stopped.is_set():
+                changed = self.watcher.read(self.debounce if pending else 0.5)
+                if changed:
+                    pending |= changed
+                    last_event = time.monotonic()
+                    continue
+                if pending and time.monotonic() - last_event >= self.debounce:
+                    self.apply(pending)
+                    pending = set()
+        finally:
+            self.watcher.close()
+
+    def apply(self, paths):
+        with self.lock:
+            return self.apply_changes(paths)
+
+    def apply_changes(self, paths):
+        scanner = self.scanner
+        # Изменился .gitignore: правила сбрасываются, а каталог с ним пересканируется целиком
+        for path in list(paths):
+            if os.path.basename(path) in IGNORE_FILES:
+                scanner.matcher.reset_rules()
+                paths.add(os.path.dirname(path))
+                self.watcher.rewatch(os.path.dirname(path))
+        removed, added = scanner.update(paths)
+        if self.export_path and (removed or added):
+            rewrite_export(scanner.structure, scanner.folder_path, self.export_path, self.export_format, self.dedupe)
+        if self.on_update is not None:
+            self.on_update(removed, added)
+        return removed, added
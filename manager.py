@@ -1,23 +1,189 @@
 import os
-from charset_normalizer import detect
-import json
+import queue
+import re
 import tkinter as tk
 import threading
-import fnmatch
-from tkinter import ttk, filedialog, messagebox
-from collections import defaultdict
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from binaryornot.check import is_binary
-
-# Константы
-MAX_FILE_SIZE = None
-MAX_CONTENT_LENGTH = None
-CONFIG_FILE = 'codemerger_config.json'
-BINARY_EXTENSIONS = {
-    '.exe', '.dll', '.jpg', '.png', '.zip', '.pdf', '.bin', '.ico',
-    '.mp3', '.mp4'
-}
+from tkinter import ttk, filedialog, font, messagebox
+
+from codemerger.budget import export_budgeted
+from codemerger.cache import MAX_CACHE_SIZE, ScanCache, cache_path_for
+from codemerger.config import CONFIG_FILE, MAX_CONTENT_LENGTH, MAX_FILE_SIZE, load_config, save_config
+from codemerger.exporters import export_file, format_for_path
+from codemerger.records import STATUSES, RecordStore
+from codemerger.scanner import Scanner
+from codemerger.search import NameIndex, search_content as find_in_content
+from codemerger.stats import ScanStats
+from codemerger.viewer import open_document
+from codemerger.watch import DEBOUNCE, WatchSession
+
+# Список файлов виртуальный: в Treeview живут только видимые строки
+ROW_HEIGHT = 20
+HEADER_HEIGHT = 25
+WHEEL_ROWS = 3
+# Как часто главный цикл Tk забирает результаты сканирования из очереди, мс
+POLL_INTERVAL = 100
+# Пауза после нажатия клавиши в поиске файла, прежде чем пересчитать выдачу, мс
+NAME_SEARCH_DELAY = 150
+# Сколько строк над найденной в окне просмотра
+MATCH_CONTEXT_LINES = 3
+JSON_FILETYPES = [
+    ('JSON', '*.json'),
+    ('JSON Lines', '*.jsonl'),
+    ('JSON Lines, gzip', '*.jsonl.gz'),
+    ('JSON Lines, zstd', '*.jsonl.zst'),
+    ('msgpack with index', '*.pack'),
+    ('All files', '*.*')
+]
+
+
+class ContentViewer:
+    # Окно просмотра: в Text только видимые строки, остальное читается из TextDocument по мере прокрутки
+    def __init__(self, root, title, document, query='', case_sensitive=False, regex=False):
+        self.document = document
+        self.top = 0
+        self.visible_lines = 25
+        self.match = None
+        self.line_height = font.nametofont('TkFixedFont').metrics('linespace')
+
+        self.window = tk.Toplevel(root)
+        self.window.title(title)
+        self.window.geometry('600x400')
+        self.window.protocol('WM_DELETE_WINDOW', self.close)
+
+        bar = ttk.Frame(self.window, padding=3)
+        bar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.line_var = tk.StringVar()
+        self.line_entry = ttk.Entry(bar, textvariable=self.line_var, width=8)
+        self.line_entry.pack(side=tk.LEFT)
+        self.line_entry.bind('<Return>', self.go_to_line)
+        self.line_entry.bind('<KP_Enter>', self.go_to_line)
+        ttk.Button(bar, text='Go to line', command=self.go_to_line, takefocus=0).pack(side=tk.LEFT, padx=(3, 10))
+        self.find_var = tk.StringVar(value=query)
+        self.find_entry = ttk.Entry(bar, textvariable=self.find_var, width=20)
+        self.find_entry.pack(side=tk.LEFT)
+        self.find_entry.bind('<Return>', self.find_next)
+        self.find_entry.bind('<KP_Enter>', self.find_next)
+        self.case_var = tk.BooleanVar(value=case_sensitive)
+        self.regex_var = tk.BooleanVar(value=regex)
+        ttk.Checkbutton(bar, text='Aa', variable=self.case_var, takefocus=0).pack(side=tk.LEFT)
+        ttk.Checkbutton(bar, text='.*', variable=self.regex_var, takefocus=0).pack(side=tk.LEFT)
+        ttk.Button(bar, text='Find next', command=self.find_next, takefocus=0).pack(side=tk.LEFT, padx=3)
+        self.status = ttk.Label(bar, anchor=tk.E)
+        self.status.pack(side=tk.RIGHT)
+
+        x_scrollbar = ttk.Scrollbar(self.window, orient=tk.HORIZONTAL)
+        x_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.scrollbar = ttk.Scrollbar(self.window, orient=tk.VERTICAL, command=self.scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text = tk.Text(self.window, wrap=tk.NONE, font='TkFixedFont', xscrollcommand=x_scrollbar.set)
+        self.text.pack(fill=tk.BOTH, expand=True)
+        x_scrollbar.config(command=self.text.xview)
+        self.text.tag_configure('match', background='#f9e79f')
+
+        self.text.bind('<Configure>', self.resize)
+        self.text.bind('<MouseWheel>', self.wheel)
+        self.text.bind('<Button-4>', self.wheel)
+        self.text.bind('<Button-5>', self.wheel)
+        # Свои обработчики вместо прокрутки самого Text: в нём нет строк за пределами окна
+        self.text.bind('<Up>', lambda e: self.move(-1))
+        self.text.bind('<Down>', lambda e: self.move(1))
+        self.text.bind('<Prior>', lambda e: self.move(-self.visible_lines))
+        self.text.bind('<Next>', lambda e: self.move(self.visible_lines))
+        self.text.bind('<Control-Home>', lambda e: self.move(-self.document.line_count))
+        self.text.bind('<Control-End>', lambda e: self.move(self.document.line_count))
+        self.window.bind('<Control-g>', lambda e: self.line_entry.focus_set())
+        self.window.bind('<Control-f>', lambda e: self.find_entry.focus_set())
+        self.text.focus_set()
+
+        if query:
+            self.find_next()
+        else:
+            self.render()
+
+    def close(self):
+        self.document.close()
+        self.window.destroy()
+
+    def render(self):
+        document = self.document
+        self.top = min(max(self.top, 0), max(document.line_count - self.visible_lines, 0))
+        lines = document.lines(self.top, self.visible_lines)
+        text = self.text
+        text.config(state=tk.NORMAL)
+        text.delete('1.0', tk.END)
+        text.insert('1.0', '\n'.join(lines))
+        if self.match is not None:
+            line, column, length = self.match
+            if self.top <= line < self.top + len(lines):
+                start = f"{line - self.top + 1}.{column}"
+                text.tag_add('match', start, f"{start}+{length}c")
+                # see() нужен для горизонтальной прокрутки к совпадению, по вертикали окно всегда с первой строки
+                text.see(start)
+                text.yview_moveto(0)
+        text.config(state=tk.DISABLED)
+
+        total = document.line_count
+        self.scrollbar.set(self.top / total, (self.top + len(lines)) / total)
+        self.status.config(text=f"Lines {self.top + 1}-{self.top + len(lines)} of {total}")
+
+    def resize(self, event):
+        lines = max(event.height // self.line_height, 1)
+        if lines != self.visible_lines:
+            self.visible_lines = lines
+            self.render()
+
+    def scroll(self, *args):
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * self.document.line_count)
+        elif args[0] == 'scroll':
+            step = self.visible_lines if args[2] == 'pages' else 1
+            self.top += int(args[1]) * step
+        self.render()
+
+    def wheel(self, event):
+        if event.num == 4:
+            delta = -WHEEL_ROWS
+        elif event.num == 5:
+            delta = WHEEL_ROWS
+        else:
+            delta = -WHEEL_ROWS if event.delta > 0 else WHEEL_ROWS
+        return self.move(delta)
+
+    def move(self, delta):
+        self.top += delta
+        self.render()
+        return 'break'
+
+    def go_to_line(self, event=None):
+        try:
+            line = int(self.line_var.get()) - 1
+        except ValueError:
+            self.status.config(text="Enter a line number")
+            return
+        line = min(max(line, 0), self.document.line_count - 1)
+        self.match = (line, 0, 0)
+        self.top = line - MATCH_CONTEXT_LINES
+        self.render()
+
+    def find_next(self, event=None):
+        query = self.find_var.get()
+        if not query:
+            return
+        # Поиск продолжается со строки после последнего совпадения, дойдя до конца - с начала
+        start = self.match[0] + 1 if self.match is not None else self.top
+        try:
+            found = self.document.find(query, start, self.regex_var.get(), self.case_var.get())
+            if found is None and start > 0:
+                found = self.document.find(query, 0, self.regex_var.get(), self.case_var.get())
+        except re.error as e:
+            self.status.config(text=f"Invalid pattern: {e}")
+            return
+        if found is None:
+            self.status.config(text="No matches")
+            return
+        self.match = found
+        self.top = found[0] - MATCH_CONTEXT_LINES
+        self.render()
 
 
 class CodeMerger:
@@ -32,33 +198,42 @@ class CodeMerger:
         self.max_file_size = self.config.get('max_file_size', MAX_FILE_SIZE)
         self.excluded_files = set(self.config.get('excluded_files', []))
         self.ignore_patterns = self.config.get('ignore_patterns', [])
-        self.structure = defaultdict(list)
+        self.cache = None
+        if self.config.get('use_cache', True):
+            self.cache = ScanCache(cache_path_for(CONFIG_FILE), self.config.get('max_cache_size', MAX_CACHE_SIZE))
+        self.structure = RecordStore()
+        self.row_records = {}
+        self.display_paths = {}
+        self.views = self.empty_views()
+        self.name_index = NameIndex()
+        self.name_search_job = None
+        self.view = []
+        self.view_offset = 0
+        self.visible_rows = 25
+        self.selected_index = None
+        self.scanner = None
+        self.scan_queue = queue.Queue()
+        # Последний завершённый скан: за его папкой следит режим наблюдения
+        self.last_scanner = None
+        self.last_export = None
+        self.watch_session = None
+        self.watch_queue = queue.Queue()
+        # Поток наблюдения меняет записи под этой блокировкой, окно читает их под ней же
+        self.structure_lock = threading.Lock()
+        self.watch_var = tk.BooleanVar(value=False)
         self.current_filter = tk.StringVar(value='ALL')
-        self.lock = threading.Lock()
         self.folder_path = ""
         self.search_file_var = tk.StringVar()
         self.search_content_var = tk.StringVar()
+        self.search_regex_var = tk.BooleanVar(value=False)
+        self.search_case_var = tk.BooleanVar(value=False)
         self.max_content_length_var = tk.StringVar()
         self.excluded_files_var = tk.StringVar(value=', '.join(self.excluded_files))
         self.max_file_size_var = tk.StringVar()
         self.setup_ui()
 
     def load_app_config(self):
-        if os.path.exists(CONFIG_FILE):
-            try:
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception:
-                pass
-        default_config = {
-            'max_content_length': None,
-            'max_file_size': None,
-            'excluded_files': [],
-            'ignore_patterns': []
-        }
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(default_config, f, ensure_ascii=False, indent=4)
-        return default_config
+        return load_config()
 
     def save_app_config(self):
         max_length_text = self.max_content_length_var.get()
@@ -88,8 +263,7 @@ class CodeMerger:
         self.config['excluded_files'] = list(self.excluded_files)
         self.config['ignore_patterns'] = self.ignore_patterns
         try:
-            with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, ensure_ascii=False, indent=4)
+            save_config(self.config)
         except Exception as e:
             print(f"Error saving config: {e}")
 
@@ -123,6 +297,7 @@ class CodeMerger:
                   background=[('active', '#3498db')],
                   foreground=[('active', 'white')])
 
+        style.configure('Treeview', rowheight=ROW_HEIGHT)
         style.configure('TreeFrame.TFrame', background=bg_color)
         style.configure('IgnoreFrame.TFrame', background=bg_color)
         style.configure('SettingsFrame.TFrame', background=bg_color)
@@ -135,8 +310,12 @@ class CodeMerger:
                    style='Modern.TButton', width=10, takefocus=0).pack(side=tk.LEFT, padx=3)
         ttk.Button(btn_frame, text='▶ Start', command=self.start_scan,
                    style='Modern.TButton', width=9, takefocus=0).pack(side=tk.LEFT, padx=3)
+        ttk.Button(btn_frame, text='■ Stop', command=self.cancel_scan,
+                   style='Modern.TButton', width=9, takefocus=0).pack(side=tk.LEFT, padx=3)
         ttk.Button(btn_frame, text='🗑 Clear', command=self.remove_all_files,
                    style='Modern.TButton', width=9, takefocus=0).pack(side=tk.LEFT, padx=3)
+        ttk.Checkbutton(btn_frame, text='Watch', variable=self.watch_var, command=self.toggle_watch,
+                        takefocus=0).pack(side=tk.LEFT, padx=3)
 
         ttk.Label(btn_frame, text="🔍", font=('Arial', 12)).pack(side=tk.LEFT, padx=(3, 0))
         self.search_file_entry = ttk.Entry(btn_frame, textvariable=self.search_file_var, width=15, font=('Segoe UI', 9))
@@ -145,6 +324,7 @@ class CodeMerger:
         self.search_file_entry.config(foreground='grey')
         self.search_file_entry.bind('<FocusIn>', self.clear_placeholder_search_file)
         self.search_file_entry.bind('<FocusOut>', self.restore_placeholder_search_file)
+        self.search_file_entry.bind('<KeyRelease>', self.schedule_name_search)
         self.search_file_entry.bind('<Return>', self.search_file)
         self.search_file_entry.bind('<KP_Enter>', self.search_file)
 
@@ -158,6 +338,10 @@ class CodeMerger:
         self.search_content_entry.bind('<FocusOut>', self.restore_placeholder_search_content)
         self.search_content_entry.bind('<Return>', self.search_content)
         self.search_content_entry.bind('<KP_Enter>', self.search_content)
+        ttk.Checkbutton(btn_frame, text='Aa', variable=self.search_case_var,
+                        takefocus=0).pack(side=tk.LEFT)
+        ttk.Checkbutton(btn_frame, text='.*', variable=self.search_regex_var,
+                        takefocus=0).pack(side=tk.LEFT, padx=(0, 3))
 
         self.status_menu = ttk.OptionMenu(
             btn_frame,
@@ -190,11 +374,19 @@ class CodeMerger:
         self.file_list.column('status', width=80, anchor=tk.CENTER)
         self.file_list.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
-        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.file_list.yview)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.file_list.configure(yscrollcommand=scrollbar.set)
+        self.list_scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.scroll_file_list)
+        self.list_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
         self.file_list.bind('<Double-1>', self.show_file_content)
+        self.file_list.bind('<Configure>', self.resize_file_list)
+        self.file_list.bind('<MouseWheel>', self.wheel_file_list)
+        self.file_list.bind('<Button-4>', self.wheel_file_list)
+        self.file_list.bind('<Button-5>', self.wheel_file_list)
+        self.file_list.bind('<<TreeviewSelect>>', self.remember_selection)
+        self.file_list.bind('<Up>', lambda e: self.move_selection(-1))
+        self.file_list.bind('<Down>', lambda e: self.move_selection(1))
+        self.file_list.bind('<Prior>', lambda e: self.move_selection(-self.visible_rows))
+        self.file_list.bind('<Next>', lambda e: self.move_selection(self.visible_rows))
 
         ignore_frame = ttk.Frame(self.root, borderwidth=0)
         ignore_frame.pack(side=tk.TOP, anchor=tk.W, padx=10, pady=(5, 0))
@@ -356,38 +548,30 @@ class CodeMerger:
     def apply_filter_from_menu(self, value):
         self.update_file_list()
 
-    def show_file_content(self, event=None):
+    def selected_record(self):
         item = self.file_list.selection()
         if not item:
-            return
-        selected_values = self.file_list.item(item, 'values')
-        file_name = selected_values[0]
-
-        file_data = None
-        for folder_files in self.structure.values():
-            for f in folder_files:
-                if f['name'] == file_name:
-                    relative_path = os.path.relpath(f['path'], self.folder_path)
-                    if relative_path in selected_values[1]:
-                        file_data = f
-                        break
-            if file_data:
-                break
+            return None
+        return self.row_records.get(item[0])
 
+    def show_file_content(self, event=None):
+        if not self.file_list.selection():
+            return
+        file_data = self.selected_record()
         if not file_data:
             messagebox.showerror("Error", "File data not found in structure.")
             return
-        if not file_data['content']:
+        with self.structure_lock:
+            document = open_document(self.structure, file_data)
+        if document is None:
             messagebox.showinfo("Content", "No readable content available.")
             return
-
-        content_window = tk.Toplevel(self.root)
-        content_window.title(f"Content of {file_data['name']}")
-        content_window.geometry('600x400')
-        text_area = tk.Text(content_window, wrap=tk.WORD)
-        text_area.insert(tk.END, file_data['content'])
-        text_area.pack(fill=tk.BOTH, expand=True)
-        text_area.config(state=tk.DISABLED)
+        # Запрос из поиска по содержимому сразу ищется в открытом файле
+        query = self.search_content_var.get().strip()
+        if query == "Search content":
+            query = ''
+        ContentViewer(self.root, f"Content of {file_data.name}", document, query,
+                      self.search_case_var.get(), self.search_regex_var.get())
 
     def show_context_menu(self, event):
         item = self.file_list.identify_row(event.y)
@@ -396,9 +580,9 @@ class CodeMerger:
             self.context_menu.post(event.x_root, event.y_root)
 
     def open_selected_file(self):
-        item = self.file_list.selection()
-        if item:
-            path = self.get_full_path_from_display_path(self.file_list.item(item, 'values')[1])
+        record = self.selected_record()
+        if record:
+            path = self.structure.path(record)
             if path:
                 try:
                     if os.name == 'nt':
@@ -409,17 +593,17 @@ class CodeMerger:
                     messagebox.showerror("Error", f"Cannot open file: {str(e)}")
 
     def copy_file_path(self):
-        item = self.file_list.selection()
-        if item:
-            path = self.get_full_path_from_display_path(self.file_list.item(item, 'values')[1])
+        record = self.selected_record()
+        if record:
+            path = self.structure.path(record)
             if path:
                 self.root.clipboard_clear()
                 self.root.clipboard_append(path)
 
     def reveal_in_explorer(self):
-        item = self.file_list.selection()
-        if item:
-            path = self.get_full_path_from_display_path(self.file_list.item(item, 'values')[1])
+        record = self.selected_record()
+        if record:
+            path = self.structure.path(record)
             if path:
                 folder = os.path.dirname(path)
                 try:
@@ -430,61 +614,72 @@ class CodeMerger:
                 except Exception as e:
                     messagebox.showerror("Error", f"Cannot open folder: {str(e)}")
 
-    def get_full_path_from_display_path(self, display_path):
-        for folder_files in self.structure.values():
-            for f in folder_files:
-                relative_path = os.path.relpath(f['path'], self.folder_path)
-                root_drive = os.path.splitdrive(self.folder_path)[0] + "/"
-                folder_name = os.path.basename(self.folder_path.rstrip('/\\'))
-                constructed_display_path = f"{root_drive}.../{folder_name}/{relative_path}"
-                if constructed_display_path == display_path:
-                    return f['path']
-        return None
+    def display_path(self, record):
+        display_path = self.display_paths.get(record)
+        if display_path is None:
+            root_path = self.structure.root
+            root_drive = os.path.splitdrive(root_path)[0] + "/"
+            folder_name = os.path.basename(root_path.rstrip('/\\'))
+            display_path = f"{root_drive}.../{folder_name}/{self.structure.rel_path(record)}"
+            self.display_paths[record] = display_path
+        return display_path
+
+    def name_query(self):
+        query = self.search_file_var.get().strip()
+        return "" if query == "Search file" else query
+
+    def schedule_name_search(self, event=None):
+        if event is not None and event.keysym in ('Return', 'KP_Enter'):
+            return
+        if self.name_search_job is not None:
+            self.root.after_cancel(self.name_search_job)
+        self.name_search_job = self.root.after(NAME_SEARCH_DELAY, self.run_name_search)
+
+    def run_name_search(self):
+        self.name_search_job = None
+        self.update_file_list()
+        query = self.name_query()
+        if query:
+            self.action_status.config(text=f"Files matching: {query}" if self.view else "No file matches")
+            self.stats_status.config(text=f"Matches: {len(self.view)}")
 
     def search_file(self, event=None):
-        query = self.search_file_var.get().strip().lower()
-        if not query or query == "search file":
-            return
-        children = list(self.file_list.get_children())
-        if not children:
+        # Выдача уже отсортирована по релевантности, Enter переходит к следующему файлу
+        if not self.name_query() or not self.view:
             return
-        current_selection = self.file_list.selection()
-        start_index = children.index(current_selection[0]) + 1 if current_selection else 0
-        if start_index >= len(children):
-            start_index = 0
-        for i in range(start_index, len(children)):
-            values = self.file_list.item(children[i], 'values')
-            if query in values[0].lower():
-                self.file_list.selection_set(children[i])
-                self.file_list.focus(children[i])
-                self.file_list.see(children[i])
-                self.action_status.config(text=f"Found file: {values[0]}")
-                self.stats_status.config(text="")
-                return
-        self.action_status.config(text="No file matches")
+        index = self.selected_index + 1 if self.selected_index is not None else 0
+        if index >= len(self.view):
+            index = 0
+        self.show_index(index)
+        self.action_status.config(text=f"Found file: {self.view[index].name}")
         self.stats_status.config(text="")
 
     def search_content(self, event=None):
-        query = self.search_content_var.get().strip().lower()
-        if not query or query == "search content":
+        query = self.search_content_var.get().strip()
+        if not query or query == "Search content":
             return
-        children = list(self.file_list.get_children())
-        if not children:
+        if not self.view:
             return
-        current_selection = self.file_list.selection()
-        start_index = children.index(current_selection[0]) + 1 if current_selection else 0
-        if start_index >= len(children):
+        try:
+            with self.structure_lock:
+                hits = find_in_content(self.structure, query, regex=self.search_regex_var.get(),
+                                       case_sensitive=self.search_case_var.get())
+        except re.error as e:
+            self.action_status.config(text=f"Invalid pattern: {e}")
+            self.stats_status.config(text="")
+            return
+        first_hits = {}
+        for hit in hits:
+            first_hits.setdefault(hit.record, hit)
+        start_index = self.selected_index + 1 if self.selected_index is not None else 0
+        if start_index >= len(self.view):
             start_index = 0
-        for i in range(start_index, len(children)):
-            values = self.file_list.item(children[i], 'values')
-            file_data = next((f for folder in self.structure.values() for f in folder if
-                              os.path.relpath(f['path'], self.folder_path) in values[1]), None)
-            if file_data and file_data['content'] and query in file_data['content'].lower():
-                self.file_list.selection_set(children[i])
-                self.file_list.focus(children[i])
-                self.file_list.see(children[i])
-                self.action_status.config(text=f"Found content in: {values[0]}")
-                self.stats_status.config(text="")
+        for i in range(start_index, len(self.view)):
+            hit = first_hits.get(self.view[i])
+            if hit:
+                self.show_index(i)
+                self.action_status.config(text=f"Found content in: {hit.record.name} (line {hit.line_no})")
+                self.stats_status.config(text=f"Matches: {len(hits)} in {len(first_hits)} files")
                 return
         self.action_status.config(text="No content matches")
         self.stats_status.config(text="")
@@ -522,187 +717,347 @@ class CodeMerger:
         if not self.folder_path:
             messagebox.showwarning("Error", "Select folder first")
             return
+        if self.scanner is not None:
+            return
+        self.stop_watch()
         self.save_app_config()
+        self.scanner = Scanner(
+            max_content_length=self.max_content_length,
+            truncate_mode=self.config.get('truncate_mode', 'head'),
+            max_file_size=self.max_file_size,
+            excluded_files=self.excluded_files,
+            ignore_patterns=self.ignore_patterns,
+            cache=self.cache,
+            use_gitignore=self.config.get('use_gitignore', True),
+            walker_threads=self.config.get('walker_threads'),
+            encodings=self.config.get('encodings', {}),
+            executor=self.config.get('executor', 'thread'),
+            workers=self.config.get('workers'),
+            chunk_size=self.config.get('chunk_size'),
+            keep_content=self.config.get('keep_content', True),
+            content_index=self.config.get('content_index', True),
+            use_git_index=self.config.get('use_git_index', False),
+            stats=ScanStats() if self.config.get('scan_trace') else None,
+            on_records=self.scan_queue.put
+        )
+        self.structure = RecordStore(self.folder_path)
+        self.display_paths = {}
+        self.views = self.empty_views()
+        self.name_index.clear()
+        self.update_file_list()
         self.action_status.config(text="Scanning...")
         self.stats_status.config(text="")
-        threading.Thread(target=self.scan_folder, args=(self.folder_path,), daemon=True).start()
-
-    def scan_folder(self, folder_path):
-        self.structure.clear()
-        processed_files = 0
-        errors = 0
-        max_workers = min(os.cpu_count() or 4, 8)
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
-            for root, _, files in os.walk(folder_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    file_ext = os.path.splitext(file)[1].lower()
-                    if any(fnmatch.fnmatch(file_path, p) for p in self.ignore_patterns):
-                        continue
-                    try:
-                        file_size = os.path.getsize(file_path)
-                        if file_ext in BINARY_EXTENSIONS or is_binary(file_path):
-                            self.add_to_structure(file_path, file_ext, status='BINARY', size=file_size)
-                            processed_files += 1
-                            continue
-                        if self.max_file_size and file_size > self.max_file_size:
-                            self.add_to_structure(file_path, file_ext, status='SKIPPED', size=file_size)
-                            processed_files += 1
-                            continue
-                        futures.append(executor.submit(self.process_file, file_path, file_ext, root, folder_path))
-                    except PermissionError:
-                        self.add_to_structure(file_path, file_ext, status='ACCESS_DENIED', size=file_size)
-                        processed_files += 1
-                        errors += 1
-                        continue
-            for future in as_completed(futures):
-                processed_files += 1
-                try:
-                    future.result()  # Проверяем, были ли ошибки в обработке
-                except Exception:
-                    errors += 1
-
-        self.root.after(0, self.update_file_list)
-        self.root.after(0, lambda: self.action_status.config(text="Scanned"))
-        self.root.after(0, lambda: self.stats_status.config(text=f"Files: {processed_files}, Errors: {errors}"))
+        threading.Thread(target=self.scan_folder, args=(self.scanner, self.folder_path), daemon=True).start()
+        self.root.after(POLL_INTERVAL, self.poll_scan)
 
-    def process_file(self, file_path, file_ext, root, folder_path):
+    def scan_folder(self, scanner, folder_path):
+        # Конец скана - None в очереди, а упавший скан передаёт вместо него исключение
+        error = None
         try:
-            with open(file_path, 'rb') as f:
-                raw_data = f.read()
-            detected = detect(raw_data)
-            encoding = detected['encoding'] if detected['confidence'] > 0.9 else 'utf-8'
-            content = raw_data.decode(encoding, errors='replace')
-            max_length = self.max_content_length if self.max_content_length is not None else None
-            if os.path.basename(file_path) in self.excluded_files:
-                max_length = None
-            truncated = "\n[TRUNCATED]" if max_length and len(content) >= max_length else ""
-            content = content[:max_length] + truncated if max_length else content
-
-            parent_folder = os.path.relpath(root, folder_path)
-            with self.lock:
-                self.structure[parent_folder].append({
-                    'name': os.path.basename(file_path),
-                    'path': file_path,
-                    'extension': file_ext,
-                    'content': content,
-                    'status': 'OK',
-                    'encoding': encoding,
-                    'size': os.path.getsize(file_path)
-                })
+            scanner.scan(folder_path)
         except Exception as e:
-            self.add_to_structure(file_path, file_ext, status='ERROR', error=str(e), size=os.path.getsize(file_path))
-            raise  # Поднимаем исключение, чтобы подсчитать ошибки
-
-    def add_to_structure(self, file_path, file_ext, status='OK', error=None, size=None):
-        parent_folder = os.path.relpath(os.path.dirname(file_path), self.folder_path)
-        content = "" if status == 'OK' else None
-        with self.lock:
-            self.structure[parent_folder].append({
-                'name': os.path.basename(file_path),
-                'path': file_path,
-                'extension': file_ext,
-                'content': content,
-                'status': status,
-                'encoding': 'unknown' if status != 'OK' else None,
-                'error': error if error else None,
-                'size': size if size is not None else os.path.getsize(file_path)
-            })
+            error = e
+        finally:
+            self.scan_queue.put(error)
+
+    def cancel_scan(self):
+        if self.scanner is not None:
+            self.scanner.cancel()
+            self.action_status.config(text="Cancelling...")
+
+    def poll_scan(self):
+        records = []
+        finished = False
+        while True:
+            try:
+                item = self.scan_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None or isinstance(item, Exception):
+                finished = True
+                break
+            records.extend(item)
+        if records:
+            self.structure = self.scanner.structure
+            self.add_to_views(records)
+            self.render_file_list()
+        if finished:
+            self.finish_scan(item)
+            return
+        self.show_scan_progress()
+        self.root.after(POLL_INTERVAL, self.poll_scan)
+
+    def show_scan_progress(self):
+        progress = self.scanner.progress
+        eta = progress.eta()
+        eta_note = f", ETA {eta:.0f}s" if eta is not None else ""
+        self.action_status.config(text="Cancelling..." if self.scanner.cancelled.is_set() else "Scanning...")
+        self.stats_status.config(
+            text=f"Files: {progress.processed}/{progress.discovered}, "
+                 f"{progress.bytes_read / (1024 * 1024):.1f} MB read, "
+                 f"{progress.rate():.0f} files/s{eta_note}"
+        )
 
-    def update_file_list(self):
-        self.file_list.delete(*self.file_list.get_children())
-        if not self.folder_path:
+    def finish_scan(self, error=None):
+        scanner = self.scanner
+        self.scanner = None
+        self.structure = scanner.structure
+        progress = scanner.progress
+        self.render_file_list()
+        if error is not None:
+            # Список неполный: за такой папкой не следим и не пишем "Scanned"
+            self.last_scanner = None
+            self.action_status.config(text=f"Scan failed: {error}")
+            self.stats_status.config(text=f"Files: {progress.processed}, Errors: {progress.errors}")
+            messagebox.showerror('Error', f'Scan failed: {str(error)}')
             return
-        root_drive = os.path.splitdrive(self.folder_path)[0] + "/"
-        folder_name = os.path.basename(self.folder_path.rstrip('/\\'))
-        for folder, files in self.structure.items():
-            for file in files:
-                if self.current_filter.get() == 'ALL' or file['status'] == self.current_filter.get():
-                    relative_path = os.path.relpath(file['path'], self.folder_path)
-                    display_path = f"{root_drive}.../{folder_name}/{relative_path}"
-                    self.file_list.insert('', 'end', values=(file['name'], display_path, file['status']))
+        self.action_status.config(text="Cancelled" if progress.cancelled else "Scanned")
+        duplicates_note = ""
+        if progress.duplicates and self.config.get('dedupe_content', True):
+            duplicates_note = f", Duplicates: {progress.duplicates} ({progress.duplicate_bytes // 1024} KB saved)"
+        self.stats_status.config(text=f"Files: {progress.processed}, Errors: {progress.errors}{duplicates_note}")
+        self.last_scanner = None if progress.cancelled else scanner
+        if scanner.stats is not None:
+            try:
+                scanner.stats.write_trace(self.config['scan_trace'], folder=scanner.folder_path,
+                                          files=progress.processed, errors=progress.errors,
+                                          bytes_read=progress.bytes_read, seconds=round(progress.elapsed(), 3))
+            except OSError as e:
+                messagebox.showerror('Error', f'Could not write scan trace: {str(e)}')
+        if self.watch_var.get():
+            self.start_watch()
+
+    def toggle_watch(self):
+        if self.watch_var.get():
+            self.start_watch()
+        else:
+            self.stop_watch()
+            self.action_status.config(text="Watch stopped")
+
+    def start_watch(self):
+        if self.scanner is not None:
+            # Наблюдение начнётся, когда закончится текущий скан
+            return
+        if self.last_scanner is None:
+            self.watch_var.set(False)
+            messagebox.showwarning("Error", "Scan a folder first")
+            return
+        if self.watch_session is not None:
+            return
+        export_path, export_format = self.last_export or (None, 'md')
+        self.watch_session = WatchSession(
+            self.last_scanner,
+            debounce=self.config.get('watch_debounce', DEBOUNCE),
+            poll=self.config.get('watch_poll', False),
+            export_path=export_path,
+            export_format=export_format,
+            dedupe=self.config.get('dedupe_content', True),
+            on_update=lambda removed, added: self.watch_queue.put((removed, added)),
+            lock=self.structure_lock
+        )
+        threading.Thread(target=self.watch_session.run, daemon=True).start()
+        self.action_status.config(text=f"Watching {self.last_scanner.folder_path}")
+        self.root.after(POLL_INTERVAL, self.poll_watch, self.watch_session)
+
+    def stop_watch(self):
+        if self.watch_session is not None:
+            self.watch_session.stop()
+            self.watch_session = None
+        self.watch_queue = queue.Queue()
+
+    def poll_watch(self, session):
+        # Опрос остановленной сессии прекращается, даже если уже запущена новая
+        if session is not self.watch_session:
+            return
+        removed = []
+        added = []
+        while True:
+            try:
+                item = self.watch_queue.get_nowait()
+            except queue.Empty:
+                break
+            removed.extend(item[0])
+            added.extend(item[1])
+        if removed or added:
+            self.apply_watch_update(removed, added)
+        self.root.after(POLL_INTERVAL, self.poll_watch, session)
+
+    def apply_watch_update(self, removed, added):
+        removed_set = set(removed)
+        for status, records in self.views.items():
+            self.views[status] = [record for record in records if record not in removed_set]
+        for record in removed:
+            self.display_paths.pop(record, None)
+        with self.structure_lock:
+            self.name_index.remove(removed)
+            self.add_to_views(added)
+            counts = self.structure.counts()
+        self.view = self.current_view()
+        if self.selected_index is not None and self.selected_index >= len(self.view):
+            self.selected_index = None
+        self.render_file_list()
+        self.action_status.config(text=f"Updated: -{len(removed)} +{len(added)}")
+        self.stats_status.config(text=f"Files: {sum(counts.values())}, Errors: {counts['ERROR']}")
+
+    @staticmethod
+    def empty_views():
+        views = {'ALL': []}
+        for status in STATUSES:
+            views[status] = []
+        return views
+
+    def add_to_views(self, records):
+        views = self.views
+        for record in records:
+            views['ALL'].append(record)
+            views.setdefault(record.status, []).append(record)
+        self.name_index.add_records(self.structure, records)
+
+    def current_view(self):
+        status_filter = self.current_filter.get()
+        query = self.name_query()
+        if not query:
+            return self.views.setdefault(status_filter, [])
+        matches = self.name_index.search(query)
+        if status_filter != 'ALL':
+            matches = [record for record in matches if record.status == status_filter]
+        return matches
+
+    def update_file_list(self):
+        self.view = self.current_view() if self.folder_path else []
+        self.view_offset = 0
+        self.selected_index = None
+        self.render_file_list()
+
+    def render_file_list(self):
+        rows = self.visible_rows
+        self.view_offset = min(max(self.view_offset, 0), max(len(self.view) - rows, 0))
+        count = min(rows, len(self.view) - self.view_offset)
+        items = list(self.file_list.get_children())
+        if len(items) > count:
+            self.file_list.delete(*items[count:])
+            del items[count:]
+        while len(items) < count:
+            items.append(self.file_list.insert('', 'end', values=()))
+
+        self.row_records = {}
+        selected_item = None
+        for i, item in enumerate(items):
+            index = self.view_offset + i
+            record = self.view[index]
+            self.file_list.item(item, values=(record.name, self.display_path(record), record.status))
+            self.row_records[item] = record
+            if index == self.selected_index:
+                selected_item = item
+        if selected_item:
+            self.file_list.selection_set(selected_item)
+            self.file_list.focus(selected_item)
+        else:
+            self.file_list.selection_remove(self.file_list.selection())
+
+        total = len(self.view)
+        if total:
+            self.list_scrollbar.set(self.view_offset / total, (self.view_offset + count) / total)
+        else:
+            self.list_scrollbar.set(0, 1)
+
+    def resize_file_list(self, event):
+        rows = max((event.height - HEADER_HEIGHT) // ROW_HEIGHT, 1)
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.render_file_list()
+
+    def scroll_file_list(self, *args):
+        if args[0] == 'moveto':
+            self.view_offset = int(float(args[1]) * len(self.view))
+        elif args[0] == 'scroll':
+            step = self.visible_rows if args[2] == 'pages' else 1
+            self.view_offset += int(args[1]) * step
+        self.render_file_list()
+
+    def wheel_file_list(self, event):
+        if event.num == 4:
+            delta = -WHEEL_ROWS
+        elif event.num == 5:
+            delta = WHEEL_ROWS
+        else:
+            delta = -WHEEL_ROWS if event.delta > 0 else WHEEL_ROWS
+        self.view_offset += delta
+        self.render_file_list()
+        return 'break'
+
+    def remember_selection(self, event=None):
+        item = self.file_list.selection()
+        if item and item[0] in self.row_records:
+            self.selected_index = self.view_offset + self.file_list.index(item[0])
+
+    def show_index(self, index):
+        if index < self.view_offset:
+            self.view_offset = index
+        elif index >= self.view_offset + self.visible_rows:
+            self.view_offset = index - self.visible_rows + 1
+        self.selected_index = index
+        self.render_file_list()
+
+    def move_selection(self, delta):
+        if not self.view:
+            return 'break'
+        current = self.selected_index if self.selected_index is not None else self.view_offset - 1
+        self.show_index(min(max(current + delta, 0), len(self.view) - 1))
+        return 'break'
 
     def export_json(self):
-        file_path = filedialog.asksaveasfilename(defaultextension='.json')
+        file_path = filedialog.asksaveasfilename(defaultextension='.json', filetypes=JSON_FILETYPES)
         if not file_path:
             return
-        try:
-            metadata = {
-                'scanned_folder': self.folder_path,
-                'timestamp': datetime.now().isoformat(),
-                'total_files': sum(len(files) for files in self.structure.values()),
-                'successful_files': sum(1 for folder in self.structure.values() for f in folder if f['status'] == 'OK'),
-                'error_files': sum(1 for folder in self.structure.values() for f in folder if f['status'] == 'ERROR'),
-                'binary_files': sum(1 for folder in self.structure.values() for f in folder if f['status'] == 'BINARY'),
-                'skipped_files': sum(
-                    1 for folder in self.structure.values() for f in folder if f['status'] == 'SKIPPED'),
-                'access_denied_files': sum(
-                    1 for folder in self.structure.values() for f in folder if f['status'] == 'ACCESS_DENIED')
-            }
-            structure = {}
-            for folder, files in self.structure.items():
-                structure[folder] = [
-                    {
-                        'name': f['name'],
-                        'path': os.path.relpath(f['path'], self.folder_path),
-                        'extension': f['extension'],
-                        'status': f['status'],
-                        'content': f['content'],
-                        'encoding': f.get('encoding', 'unknown'),
-                        'error': f.get('error', None),
-                        'size': f['size'],
-                        'last_modified': datetime.fromtimestamp(os.path.getmtime(f['path'])).isoformat()
-                    } for f in files
-                ]
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump({'metadata': metadata, 'structure': structure}, f, ensure_ascii=False, indent=2)
-            messagebox.showinfo('Success', f'Exported to {file_path}')
-        except Exception as e:
-            messagebox.showerror('Error', f'Export failed: {str(e)}')
+        # JSON Lines, сжатый JSON Lines или msgpack выбираются по расширению файла
+        self.export_to(file_path, format_for_path(file_path))
 
     def export_markdown(self):
         file_path = filedialog.asksaveasfilename(defaultextension='.md')
         if not file_path:
             return
+        self.export_to(file_path, 'md')
+
+    def export_to(self, file_path, fmt):
         try:
-            md_content = f"# CodeMerger: {self.folder_path}\n\n"
-            md_content += "## Summary\n"
-            total_files = sum(len(files) for files in self.structure.values())
-            errors = sum(1 for folder in self.structure.values() for f in folder if f['status'] == 'ERROR')
-            binary = sum(1 for folder in self.structure.values() for f in folder if f['status'] == 'BINARY')
-            skipped = sum(1 for folder in self.structure.values() for f in folder if f['status'] == 'SKIPPED')
-            access_denied = sum(
-                1 for folder in self.structure.values() for f in folder if f['status'] == 'ACCESS_DENIED')
-            md_content += (
-                f"- **Total Files**: {total_files}\n"
-                f"- **Successful**: {total_files - errors - binary - skipped - access_denied}\n"
-                f"- **Errors**: {errors}\n"
-                f"- **Binary**: {binary}\n"
-                f"- **Skipped**: {skipped}\n"
-                f"- **Access Denied**: {access_denied}\n"
-                f"- **Scan Date**: {datetime.now().strftime('%Y-%m-%d %H:%M')}\n\n"
-            )
-            md_content += "## Structure\n"
-            for folder, files in sorted(self.structure.items()):
-                md_content += f"### {folder if folder else 'Root'}\n"
-                for file in sorted(files, key=lambda x: x['name']):
-                    status_icon = f" `[{file['status']}]`" if file['status'] != 'OK' else ''
-                    error_note = f" (error: {file['error']})" if file.get('error') else ''
-                    size_note = f" (size: {file['size'] // 1024}kb)" if file.get('size') else ''
-                    md_content += f"- `{file['extension']}` **{file['name']}**{status_icon}{error_note}{size_note} (encoding: {file.get('encoding', 'unknown')})\n"
-                    if file['content']:
-                        md_content += f"```{(file['extension'][1:] if file['extension'] else 'text')}\n{file['content']}\n```\n"
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(md_content)
-            messagebox.showinfo('Success', f'Exported to {file_path}')
+            budget = self.config.get('token_budget')
+            dedupe = self.config.get('dedupe_content', True)
+            if not budget:
+                with self.structure_lock:
+                    export_file(self.structure, self.folder_path, file_path, fmt, dedupe)
+                # При включённом наблюдении этот файл будет переписываться после каждого изменения
+                self.last_export = (file_path, fmt)
+                if self.watch_session is not None:
+                    with self.structure_lock:
+                        self.watch_session.set_export(file_path, fmt)
+                messagebox.showinfo('Success', f'Exported to {file_path}')
+                return
+            with self.structure_lock:
+                paths, dropped = export_budgeted(
+                    self.structure, self.folder_path, file_path, fmt, budget,
+                    max_parts=self.config.get('max_parts') or 1,
+                    tokenizer=self.config.get('tokenizer', 'bytes'),
+                    priority_patterns=self.config.get('priority_patterns', []),
+                    dedupe=dedupe
+                )
+            dropped_note = f'\n{len(dropped)} files did not fit into the token budget' if dropped else ''
+            messagebox.showinfo('Success', f'Exported to {", ".join(paths)}{dropped_note}')
         except Exception as e:
             messagebox.showerror('Error', f'Export failed: {str(e)}')
 
     def remove_all_files(self):
-        self.file_list.delete(*self.file_list.get_children())
-        self.structure.clear()
+        if self.scanner is not None:
+            return
+        self.stop_watch()
+        self.watch_var.set(False)
+        self.last_scanner = None
+        with self.structure_lock:
+            self.structure.clear()
+        self.display_paths = {}
+        self.views = self.empty_views()
+        self.name_index.clear()
+        self.update_file_list()
         self.action_status.config(text="List cleared")
         self.stats_status.config(text="")
 
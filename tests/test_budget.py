@@ -0,0 +1,43 @@
+import io
+
+import pytest
+
+from codemerger.budget import byte_tokens, pack
+from codemerger.exporters import BINARY_FORMATS, WRITERS
+from codemerger.scanner import Scanner
+
+BUDGET = 2000
+
+
+@pytest.fixture(scope='module')
+def structure(tmp_path_factory):
+    root = tmp_path_factory.mktemp('tree')
+    for n in range(200):
+        folder = root / f"pkg{n % 7}"
+        folder.mkdir(exist_ok=True)
+        # Кавычки, табуляции и переводы строк раздувают JSON при экранировании
+        lines = [f'def handler_{n}(request):\n\tprint("value \\"{n}\\"", \'x\')\n' for _ in range(n % 5 + 1)]
+        (folder / f"m{n}.py").write_text(''.join(lines))
+    (root / 'big.py').write_text('x = "\\t\\n"\n' * 2000)
+    scanner = Scanner()
+    scanner.scan(str(root))
+    return scanner.structure
+
+
+def rendered_tokens(part, fmt):
+    out = io.BytesIO() if fmt in BINARY_FORMATS else io.StringIO()
+    WRITERS[fmt](part, part.root, out)
+    text = out.getvalue()
+    return byte_tokens(text.decode('utf-8', 'replace') if isinstance(text, bytes) else text)
+
+
+@pytest.mark.parametrize('fmt', ['md', 'json', 'jsonl', 'msgpack'])
+def test_parts_fit_budget(structure, fmt):
+    if fmt == 'msgpack':
+        pytest.importorskip('msgpack')
+    parts, dropped = pack(structure, BUDGET, 3, fmt=fmt)
+    assert len(parts) == 3
+    assert dropped
+    for part in parts:
+        assert len(part)
+        assert rendered_tokens(part, fmt) <= BUDGET
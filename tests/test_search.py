@@ -0,0 +1,39 @@
+import re
+
+import pytest
+
+from codemerger.records import RecordStore
+from codemerger.search import literal_from_regex, search_content
+
+# Шаблон и строка, которую он обязан найти
+PATTERNS = [
+    (r'\x70rint', 'print(1)'),
+    (r'\160rint', 'print(1)'),
+    (r'print', 'print(1)'),
+    (r'\U00000070rint', 'print(1)'),
+    (r'\N{LATIN SMALL LETTER P}rint', 'print(1)'),
+    (r'\0rint', '\0rint'),
+    ('(?x) p r i n t', 'print(1)'),
+    ('(?i)PRINT', 'print(1)'),
+    (r'(a)\1bcd', 'aabcd'),
+    ('x{3}', 'xxx'),
+    ('ab{2,3}c', 'abbc'),
+    (r'\d{3}', 'id 123'),
+    (r'def \w+_\d+\(', 'def handler_1(request):'),
+]
+
+
+@pytest.mark.parametrize('pattern, line', PATTERNS)
+def test_literal_is_part_of_every_match(pattern, line):
+    match = re.search(pattern, line)
+    assert match
+    assert literal_from_regex(pattern) in match.group()
+
+
+@pytest.mark.parametrize('pattern, line', PATTERNS)
+def test_search_content_finds_regex(pattern, line):
+    structure = RecordStore('/project')
+    structure.add('.', 'a.py', '.py', 'OK', 'utf-8', content=f"# header\n{line}\n")
+    structure.add('.', 'b.py', '.py', 'OK', 'utf-8', content="nothing here\n")
+    hits = search_content(structure, pattern, regex=True, case_sensitive=True)
+    assert [(hit.record.name, hit.line_no) for hit in hits] == [('a.py', 2)]
@@ -0,0 +1,49 @@
+import os
+import threading
+import time
+
+from codemerger.scanner import Scanner
+from codemerger.watch import WatchSession, exclude_export, rewrite_export
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_export_inside_watched_folder_is_rewritten_once(tmp_path):
+    folder = str(tmp_path)
+    (tmp_path / 'a.py').write_text('print(1)\n')
+    output = os.path.join(folder, 'out.md')
+    scanner = Scanner()
+    exclude_export(scanner, output)
+    scanner.scan(folder)
+    rewrite_export(scanner.structure, folder, output, 'md')
+
+    updates = []
+    session = WatchSession(scanner, debounce=0.1, export_path=output,
+                           on_update=lambda removed, added: updates.append((removed, added)))
+    thread = threading.Thread(target=session.run, daemon=True)
+    thread.start()
+    try:
+        # Наблюдение начинается не сразу после запуска потока
+        assert wait_for(lambda: session.watcher is not None)
+        time.sleep(0.2)
+        (tmp_path / 'a.py').write_text('print(2)\n')
+        assert wait_for(lambda: updates)
+        # Перезапись out.md и out.md.tmp не должна вызывать новых обновлений
+        time.sleep(1.0)
+    finally:
+        session.stop()
+        thread.join(5)
+
+    assert len(updates) == 1
+    assert [scanner.structure.rel_path(record) for record in scanner.structure] == ['a.py']
+    with open(output, 'r', encoding='utf-8') as f:
+        export = f.read()
+    assert 'print(2)' in export
+    assert 'out.md' not in export